@@ -1,33 +1,191 @@
 from fastapi import APIRouter, HTTPException
-from pydantic import BaseModel
-from typing import Optional, Dict, Any
+from pydantic import BaseModel, Field, validator
+from typing import Optional, Dict, Any, List
+import os
+import re
+
+from app.services.code_executor import (
+    code_executor, ExecutionConfig, INTERPRETERS, MAX_TIMEOUT, RESOURCE_PROFILES
+)
+from app.services.job_queue import JobQueueError
 
 router = APIRouter()
 
+ENV_NAME_PATTERN = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+# Variables that would let a submission change how the interpreter itself starts
+BLOCKED_ENV_VARS = {"PYTHONHOME", "PYTHONPATH", "PYTHONSTARTUP", "PYTHONUSERBASE"}
+MAX_CODE_BYTES = int(os.getenv("MAX_CODE_BYTES", str(256 * 1024)))
+
 class CodeExecutionRequest(BaseModel):
     code: str
     language: str = "python"
-    timeout: Optional[int] = 30
+    timeout: Optional[int] = Field(None, ge=1, le=MAX_TIMEOUT)  # defaults to CODE_TIMEOUT
+    resource_profile: Optional[str] = None  # strict, default, relaxed
+    interpreter: Optional[str] = None
+    env: Dict[str, str] = Field(default_factory=dict)
+    cache: bool = True  # set to False for non-deterministic code
+
+    @validator("code")
+    def check_code(cls, value):
+        if len(value.encode("utf-8", errors="surrogatepass")) > MAX_CODE_BYTES:
+            raise ValueError(f"Code must be at most {MAX_CODE_BYTES} bytes")
+        return value
+
+    @validator("language")
+    def check_language(cls, value):
+        if value != "python":
+            raise ValueError("Only python is supported")
+        return value
+
+    @validator("resource_profile")
+    def check_resource_profile(cls, value):
+        if value is not None and value not in RESOURCE_PROFILES:
+            raise ValueError(f"Unknown resource profile, expected one of {sorted(RESOURCE_PROFILES)}")
+        return value
+
+    @validator("interpreter")
+    def check_interpreter(cls, value):
+        if value is not None and value not in INTERPRETERS:
+            raise ValueError(f"Unknown interpreter, expected one of {sorted(INTERPRETERS)}")
+        return value
+
+    @validator("env")
+    def check_env(cls, value):
+        if len(value) > 32:
+            raise ValueError("At most 32 environment variables are allowed")
+        for name in value:
+            if not ENV_NAME_PATTERN.match(name) or name in BLOCKED_ENV_VARS or name.startswith("LD_"):
+                raise ValueError(f"Environment variable not allowed: {name}")
+        return value
+
+    def to_execution_config(self) -> ExecutionConfig:
+        return code_executor.build_config(
+            timeout=self.timeout,
+            resource_profile=self.resource_profile,
+            interpreter=self.interpreter,
+            env=self.env,
+            use_cache=self.cache
+        )
+
+MAX_BATCH_CASES = int(os.getenv("MAX_BATCH_CASES", "200"))
+
+class BatchTestCase(BaseModel):
+    name: Optional[str] = None
+    stdin: Optional[str] = None
+    args: List[str] = Field(default_factory=list)
+    expected_output: Optional[str] = None
+
+def check_case_count(cases: List[BatchTestCase]) -> List[BatchTestCase]:
+    if not cases:
+        raise ValueError("At least one test case is required")
+    if len(cases) > MAX_BATCH_CASES:
+        raise ValueError(f"At most {MAX_BATCH_CASES} test cases are allowed")
+    return cases
+
+class BatchExecutionRequest(CodeExecutionRequest):
+    test_cases: List[BatchTestCase]
+
+    @validator("test_cases")
+    def check_test_cases(cls, value):
+        return check_case_count(value)
+
+class JobRequest(CodeExecutionRequest):
+    test_cases: Optional[List[BatchTestCase]] = None  # submits a batch job when given
+
+    @validator("test_cases")
+    def check_test_cases(cls, value):
+        return check_case_count(value) if value is not None else value
+
+MAX_JOB_WAIT = 60
+
+def public_job(job: Dict[str, Any]) -> Dict[str, Any]:
+    """Job record without the submitted payload"""
+    return {
+        "job_id": job["id"],
+        "status": job["status"],
+        "queue": job["queue"],
+        "attempts": job["attempts"],
+        "created_at": job["created_at"],
+        "started_at": job["started_at"],
+        "finished_at": job["finished_at"],
+        "result": job["result"],
+        "error": job["error"]
+    }
 
 class CodeExplanationRequest(BaseModel):
     code: str
     detail_level: Optional[str] = "medium"  # basic, medium, detailed
 
+async def run_execution(request: CodeExecutionRequest) -> Dict[str, Any]:
+    """
+    Shared execution path for /execute and /api/execute
+    """
+    try:
+        config = request.to_execution_config()
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return await code_executor.execute_python_code(request.code, config=config)
+
 @router.post("/execute")
 async def execute_code(request: CodeExecutionRequest) -> Dict[str, Any]:
     """
     Execute Python code in a secure environment and return the results
     """
+    return await run_execution(request)
+
+@router.post("/execute/batch")
+async def execute_batch(request: BatchExecutionRequest) -> Dict[str, Any]:
+    """
+    Run the same code against a suite of test cases and grade the outputs
+    """
     try:
-        # TODO: Implement secure code execution
-        # This will be implemented when we set up the code execution service
-        return {
-            "status": "success",
-            "output": "Code execution placeholder",
-            "execution_time": 0.0
-        }
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        config = request.to_execution_config()
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    cases = [case.dict() for case in request.test_cases]
+    return await code_executor.execute_batch(request.code, cases, config=config)
+
+@router.get("/execute/stats")
+async def get_execution_stats() -> Dict[str, Any]:
+    """
+    Report executor concurrency and worker pool metrics
+    """
+    return code_executor.get_stats()
+
+@router.post("/jobs", status_code=202)
+async def submit_job(request: JobRequest) -> Dict[str, Any]:
+    """
+    Queue code (or a test suite) for an execution worker and return the job id
+    """
+    try:
+        config = request.to_execution_config()
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    cases = [case.dict() for case in request.test_cases] if request.test_cases is not None else None
+    job = await code_executor.submit_job(request.code, config, cases)
+    return public_job(job)
+
+@router.get("/jobs/stats")
+async def get_job_stats() -> Dict[str, Any]:
+    """
+    Report queue depths and local worker metrics
+    """
+    return await code_executor.get_queue_stats()
+
+@router.get("/jobs/{job_id}")
+async def get_job(job_id: str, wait: float = 0) -> Dict[str, Any]:
+    """
+    Fetch a job's status and result, optionally waiting up to ``wait`` seconds for it to finish
+    """
+    if wait > 0:
+        try:
+            return public_job(await code_executor.wait_for_job(job_id, min(wait, MAX_JOB_WAIT)))
+        except JobQueueError:
+            pass
+    job = await code_executor.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return public_job(job)
 
 @router.post("/explain")
 async def explain_code(request: CodeExplanationRequest) -> Dict[str, Any]:
@@ -0,0 +1,105 @@
+import asyncio
+import os
+import time
+from typing import Any, Awaitable, Callable, List, Optional, Tuple
+
+from app.services.metrics import QUEUE_WAIT_SECONDS
+
+class MicroBatcher:
+    """
+    Groups requests that arrive close together into a single batch call
+
+    Callers ``submit`` one item and await its result. Items are collected
+    until ``max_batch_size`` is reached or ``max_wait_ms`` has passed since
+    the first one arrived, then ``process_batch`` is called once with all of
+    them and must return one result per item, in order. If every caller in
+    a batch goes away, the batch itself is cancelled.
+    """
+
+    def __init__(self, process_batch: Callable[[List[Any]], Awaitable[List[Any]]],
+                 max_batch_size: Optional[int] = None, max_wait_ms: Optional[float] = None):
+        self.process_batch = process_batch
+        self.max_batch_size = max(1, max_batch_size or int(os.getenv("LLM_MAX_BATCH_SIZE", "8")))
+        self.max_wait_ms = max_wait_ms if max_wait_ms is not None else float(os.getenv("LLM_BATCH_WAIT_MS", "10"))
+
+        # Items with their callers' futures and when they were submitted
+        self._pending: List[Tuple[Any, asyncio.Future, float]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+        self.batches_total = 0
+        self.items_total = 0
+
+    async def submit(self, item: Any) -> Any:
+        """
+        Queue one item for the next batch and wait for its result
+
+        Args:
+            item: Input passed to ``process_batch`` alongside the rest of the batch
+
+        Returns:
+            The result ``process_batch`` produced for this item
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, future, time.monotonic()))
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait_ms / 1000, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        # Callers that gave up while waiting don't need a slot in the batch
+        now = time.monotonic()
+        batch = []
+        for item, future, submitted_at in self._pending:
+            if not future.done():
+                QUEUE_WAIT_SECONDS.observe(now - submitted_at, queue="batch")
+                batch.append((item, future))
+        self._pending = []
+        while batch:
+            chunk, batch = batch[:self.max_batch_size], batch[self.max_batch_size:]
+            self._start(chunk)
+
+    def _start(self, batch: List[Tuple[Any, asyncio.Future]]):
+        self.batches_total += 1
+        self.items_total += len(batch)
+        task = asyncio.ensure_future(self._run(batch))
+
+        def on_caller_done(_):
+            if all(future.cancelled() for _, future in batch):
+                task.cancel()
+
+        for _, future in batch:
+            future.add_done_callback(on_caller_done)
+
+    async def _run(self, batch: List[Tuple[Any, asyncio.Future]]):
+        try:
+            results = await self.process_batch([item for item, _ in batch])
+        except asyncio.CancelledError:
+            for _, future in batch:
+                future.cancel()
+            raise
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    def get_stats(self) -> dict:
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait_ms,
+            "pending": len(self._pending),
+            "batches_total": self.batches_total,
+            "items_total": self.items_total,
+            "avg_batch_size": self.items_total / self.batches_total if self.batches_total else 0.0
+        }
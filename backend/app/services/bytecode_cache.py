@@ -0,0 +1,85 @@
+import hashlib
+import marshal
+import threading
+import traceback
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+class BytecodeCache:
+    """
+    In-process precheck for submissions with an LRU of their compiled code
+
+    Code is compiled the way sandbox_runner compiles it, so a syntax error
+    can be reported without starting an interpreter, and valid code is kept
+    as a marshalled code object keyed by the SHA-256 of its source that warm
+    workers load instead of compiling it again. Marshal data is only valid
+    for the Python version that produced it, so callers must check that the
+    target interpreter matches this one before using either result.
+    """
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        # Per source hash: marshalled code, or None with the formatted SyntaxError
+        self._entries: "OrderedDict[str, Tuple[Optional[bytes], Optional[str]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.syntax_errors = 0
+
+    @staticmethod
+    def make_key(code: str) -> str:
+        return hashlib.sha256(code.encode("utf-8", errors="surrogatepass")).hexdigest()
+
+    def compile(self, code: str) -> Tuple[Optional[bytes], Optional[str]]:
+        """
+        Compile a submission, reusing the result for source seen before
+
+        Returns:
+            ``(bytecode, None)`` for valid code, ``(None, error)`` with the
+            same text the sandbox prints for a syntax error, or ``(None, None)``
+            when the code cannot be checked here and must go to the sandbox
+        """
+        key = self.make_key(code)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+        if entry is None:
+            entry = self._compile(code)
+            if entry == (None, None):
+                return entry
+            with self._lock:
+                self.misses += 1
+                self._entries[key] = entry
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+        if entry[1] is not None:
+            with self._lock:
+                self.syntax_errors += 1
+        return entry
+
+    @staticmethod
+    def _compile(code: str) -> Tuple[Optional[bytes], Optional[str]]:
+        try:
+            compiled = compile(code, "<submission>", "exec", dont_inherit=True)
+        except SyntaxError as e:
+            return None, "".join(traceback.format_exception_only(type(e), e))
+        except (ValueError, RecursionError, MemoryError):
+            # Null bytes or pathological nesting: let the sandbox report it
+            return None, None
+        return marshal.dumps(compiled), None
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "syntax_errors": self.syntax_errors
+            }
@@ -1,84 +1,935 @@
-import subprocess
+import codecs
+import json
 import tempfile
 import os
+import shutil
+import signal
+import sys
 import asyncio
-from typing import Dict, Any
+from contextlib import ExitStack, asynccontextmanager, contextmanager
+from dataclasses import dataclass, field
+from types import MappingProxyType
+from typing import Dict, Any, Optional, Iterator, AsyncIterator, List, Mapping, Tuple
 import time
 
+from app.services.bytecode_cache import BytecodeCache
+from app.services.job_queue import InMemoryJobQueue, JobQueue, JobQueueError, JobWorker, job_queue_from_env
+from app.services.metrics import EXECUTOR_STAGE_SECONDS, QUEUE_WAIT_SECONDS
+from app.services.result_cache import cache_from_env
+from app.services.worker_pool import WorkerPool, WorkerError
+
+RUNNER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sandbox_runner.py")
+
+def _parse_size(value: str) -> int:
+    """Parse sizes such as ``100m`` or ``2g`` into bytes"""
+    value = value.strip().lower()
+    units = {"k": 1024, "m": 1024 ** 2, "g": 1024 ** 3}
+    if value and value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(value)
+
+# Per-run rlimits; the "default" profile honours MAX_MEMORY and MAX_OUTPUT_BYTES
+RESOURCE_PROFILES: Dict[str, Dict[str, Optional[int]]] = {
+    "strict": {
+        "cpu_seconds": 5,
+        "memory_bytes": 256 * 1024 ** 2,
+        "max_processes": 1,
+        "max_open_files": 32,
+        "max_file_bytes": 1024 ** 2,
+        "max_output_bytes": 64 * 1024
+    },
+    "default": {
+        "cpu_seconds": 30,
+        "memory_bytes": _parse_size(os.getenv("MAX_MEMORY", "512m")),
+        "max_processes": 64,
+        "max_open_files": 64,
+        "max_file_bytes": 16 * 1024 ** 2,
+        "max_output_bytes": int(os.getenv("MAX_OUTPUT_BYTES", str(1024 ** 2)))
+    },
+    "relaxed": {
+        "cpu_seconds": 120,
+        "memory_bytes": 2 * 1024 ** 3,
+        "max_processes": 256,
+        "max_open_files": 256,
+        "max_file_bytes": 256 * 1024 ** 2,
+        "max_output_bytes": 16 * 1024 ** 2
+    }
+}
+
+def _load_interpreters() -> Dict[str, str]:
+    """Interpreters users may pick, from ``CODE_INTERPRETERS=name=path,...``"""
+    interpreters = {"python3": "python"}
+    for entry in os.getenv("CODE_INTERPRETERS", "").split(","):
+        if "=" in entry:
+            name, path = entry.split("=", 1)
+            interpreters[name.strip()] = path.strip()
+    return interpreters
+
+INTERPRETERS = _load_interpreters()
+DEFAULT_INTERPRETER = "python3"
+MAX_TIMEOUT = int(os.getenv("MAX_CODE_TIMEOUT", "120"))
+
+@dataclass(frozen=True)
+class ExecutionConfig:
+    """
+    Immutable settings for a single run
+
+    Built per request and passed down explicitly, so concurrent runs never
+    share or overwrite each other's timeout, limits or environment.
+    """
+    timeout: int
+    resource_profile: str
+    limits: Mapping[str, Optional[int]]
+    interpreter: str = DEFAULT_INTERPRETER
+    env: Mapping[str, str] = field(default_factory=lambda: MappingProxyType({}))
+    # False for non-deterministic code whose results must not be reused
+    use_cache: bool = True
+
+    @property
+    def python_path(self) -> str:
+        return INTERPRETERS[self.interpreter]
+
+    @property
+    def max_output_bytes(self) -> Optional[int]:
+        return self.limits.get("max_output_bytes")
+
+def _describe_exit(returncode: int) -> Optional[str]:
+    """Explain deaths by signal, which usually mean a resource limit was hit"""
+    if returncode >= 0:
+        return None
+    try:
+        name = signal.Signals(-returncode).name
+    except ValueError:
+        return f"Process terminated by signal {-returncode}"
+    if name == "SIGXCPU":
+        return "Process terminated: CPU time limit exceeded"
+    if name == "SIGXFSZ":
+        return "Process terminated: file size limit exceeded"
+    return f"Process terminated by {name}"
+
+def _empty_resource_usage() -> Dict[str, Any]:
+    """Usage block for runs that were killed before they could report"""
+    return {"peak_rss_bytes": None, "user_cpu_time": None, "system_cpu_time": None}
+
+def _normalize_output(output: Optional[str]) -> str:
+    """Compare outputs ignoring trailing whitespace on lines and at the end"""
+    return "\n".join(line.rstrip() for line in (output or "").rstrip().splitlines())
+
+def _default_scratch_root() -> str:
+    """Prefer a RAM-backed tmpfs for per-run scratch directories"""
+    shm = "/dev/shm"
+    if os.path.isdir(shm) and os.access(shm, os.W_OK):
+        return shm
+    return tempfile.gettempdir()
+
+# Seconds to wait for a killed interpreter's pipes to close before giving up on it
+REAP_TIMEOUT = 5.0
+# Extra seconds a queued job may be held beyond its own timeout before it is retried
+JOB_VISIBILITY_MARGIN = int(os.getenv("JOB_VISIBILITY_MARGIN", "30"))
+
 class CodeExecutor:
-    def __init__(self):
-        self.timeout = 30  # Default timeout in seconds
-        
-    async def execute_python_code(self, code: str, timeout: int = None) -> Dict[str, Any]:
+    def __init__(self, max_concurrent: Optional[int] = None, engine: Optional[str] = None):
+        self.timeout = int(os.getenv("CODE_TIMEOUT", "30"))  # Default timeout in seconds
+        # Upper bound on interpreter processes running at the same time
+        self.max_concurrent = max_concurrent or int(os.getenv("MAX_CONCURRENT_EXECUTIONS", "8"))
+        self.python_path = INTERPRETERS[DEFAULT_INTERPRETER]
+        # "subprocess" spawns a fresh interpreter per run, "pool" reuses warm workers,
+        # "queue" hands runs to execution workers through the job queue
+        self.engine = engine or os.getenv("CODE_EXECUTION_ENGINE", "subprocess")
+        self.execute_queue = os.getenv("EXECUTION_QUEUE", "execute")
+        self.batch_queue = os.getenv("EXECUTION_BATCH_QUEUE", "batch")
+        # How source reaches the interpreter: "stdin", "memfd" or "tempfile"
+        self.code_delivery = os.getenv("CODE_DELIVERY", "stdin")
+        if self.code_delivery == "memfd" and not hasattr(os, "memfd_create"):
+            self.code_delivery = "stdin"
+        self.scratch_root = os.getenv("CODE_SCRATCH_DIR") or _default_scratch_root()
+        self.resource_profile = os.getenv("CODE_RESOURCE_PROFILE", "default")
+        self.cache_enabled = os.getenv("EXECUTION_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+        self.cache = cache_from_env("execution", "EXECUTION", cost_field="execution_time")
+        # Compile submissions here first so syntax errors never reach a sandbox
+        self.precheck_enabled = os.getenv("EXECUTION_PRECHECK_ENABLED", "true").lower() in ("1", "true", "yes")
+        self.bytecode_cache = BytecodeCache(int(os.getenv("BYTECODE_CACHE_SIZE", "256")))
+        # compile() holds the GIL, so longer code is left to the sandbox rather than stall the event loop
+        self.precheck_max_chars = int(os.getenv("PRECHECK_MAX_CHARS", str(64 * 1024)))
+        self._interpreter_versions: Dict[str, str] = {}
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._pool: Optional[WorkerPool] = None
+        self._job_queue: Optional[JobQueue] = None
+        self._local_worker: Optional[JobWorker] = None
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        # Created lazily so it binds to the event loop the server is running on
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrent)
+        return self._semaphore
+
+    def _get_pool(self) -> WorkerPool:
+        if self._pool is None:
+            self._pool = WorkerPool(python_path=self.python_path)
+        return self._pool
+
+    def _get_job_queue(self) -> JobQueue:
+        if self._job_queue is None:
+            self._job_queue = job_queue_from_env()
+            if isinstance(self._job_queue, InMemoryJobQueue):
+                # Nothing outside this process can see an in-memory queue, so run its jobs here
+                local = CodeExecutor(self.max_concurrent, engine=os.getenv("WORKER_EXECUTION_ENGINE", "subprocess"))
+                self._local_worker = JobWorker(self._job_queue, local.job_handlers(), {
+                    self.execute_queue: self.max_concurrent,
+                    self.batch_queue: max(1, self.max_concurrent // 4)
+                })
+                self._local_worker.start()
+        return self._job_queue
+
+    @contextmanager
+    def _scratch_directory(self) -> Iterator[str]:
+        """Private working directory for one run, removed with everything in it"""
+        path = tempfile.mkdtemp(prefix="run-", dir=self.scratch_root)
+        try:
+            yield path
+        finally:
+            with EXECUTOR_STAGE_SECONDS.time(engine=self.engine, stage="cleanup"):
+                shutil.rmtree(path, ignore_errors=True)
+
+    @asynccontextmanager
+    async def _execution_slot(self):
+        """Hold a concurrency slot, recording how long the run queued for it"""
+        started = time.perf_counter()
+        async with self._get_semaphore():
+            QUEUE_WAIT_SECONDS.observe(time.perf_counter() - started, queue="executor")
+            yield
+
+    def build_config(self, timeout: Optional[int] = None, resource_profile: Optional[str] = None,
+                     interpreter: Optional[str] = None, env: Optional[Dict[str, str]] = None,
+                     use_cache: bool = True) -> ExecutionConfig:
         """
-        Execute Python code in a secure environment
-        
+        Validate per-request options into an ExecutionConfig
+
+        Raises:
+            ValueError: If the timeout, profile or interpreter is not allowed
+        """
+        timeout = timeout or self.timeout
+        if not 0 < timeout <= MAX_TIMEOUT:
+            raise ValueError(f"Timeout must be between 1 and {MAX_TIMEOUT} seconds")
+        profile = resource_profile or self.resource_profile
+        if profile not in RESOURCE_PROFILES:
+            raise ValueError(f"Unknown resource profile: {profile}")
+        interpreter = interpreter or DEFAULT_INTERPRETER
+        if interpreter not in INTERPRETERS:
+            raise ValueError(f"Unknown interpreter: {interpreter}")
+        return ExecutionConfig(
+            timeout=timeout,
+            resource_profile=profile,
+            limits=MappingProxyType(dict(RESOURCE_PROFILES[profile])),
+            interpreter=interpreter,
+            env=MappingProxyType(dict(env or {})),
+            use_cache=use_cache
+        )
+
+    @staticmethod
+    def config_to_payload(config: ExecutionConfig) -> Dict[str, Any]:
+        """Options a worker needs to rebuild the same ExecutionConfig"""
+        return {
+            "timeout": config.timeout,
+            "resource_profile": config.resource_profile,
+            "interpreter": config.interpreter,
+            "env": dict(config.env),
+            "use_cache": config.use_cache
+        }
+
+    def job_handlers(self) -> Dict[str, Any]:
+        """Job kinds this executor can run for a JobWorker"""
+        async def run_execute(payload: Dict[str, Any]) -> Dict[str, Any]:
+            config = self.build_config(**payload["config"])
+            return await self.execute_python_code(payload["code"], config=config)
+
+        async def run_batch(payload: Dict[str, Any]) -> Dict[str, Any]:
+            config = self.build_config(**payload["config"])
+            return await self.execute_batch(payload["code"], payload["cases"], config=config)
+
+        return {"execute": run_execute, "batch": run_batch}
+
+    async def submit_job(self, code: str, config: ExecutionConfig,
+                         cases: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
+        """
+        Queue a run (or a batch of test cases) for an execution worker
+
         Args:
             code (str): Python code to execute
-            timeout (int, optional): Execution timeout in seconds
-            
+            config (ExecutionConfig): Per-run settings
+            cases (list, optional): Test cases; submits a batch job when given
+
         Returns:
-            Dict containing execution results and metadata
+            The queued job record
         """
-        if timeout:
-            self.timeout = timeout
+        payload = {"code": code, "config": self.config_to_payload(config)}
+        if cases is None:
+            return await self._get_job_queue().enqueue(
+                self.execute_queue, "execute", payload, config.timeout + JOB_VISIBILITY_MARGIN
+            )
+        payload["cases"] = cases
+        return await self._get_job_queue().enqueue(
+            self.batch_queue, "batch", payload, config.timeout * len(cases) + JOB_VISIBILITY_MARGIN
+        )
 
+    async def wait_for_job(self, job_id: str, timeout: float) -> Dict[str, Any]:
+        return await self._get_job_queue().wait(job_id, timeout)
+
+    async def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return await self._get_job_queue().get(job_id)
+
+    async def get_queue_stats(self) -> Dict[str, Any]:
+        stats = await self._get_job_queue().get_stats([self.execute_queue, self.batch_queue])
+        stats["local_worker"] = self._local_worker.get_stats() if self._local_worker is not None else None
+        return stats
+
+    async def _run_queued(self, code: str, config: ExecutionConfig,
+                          cases: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
+        """Submit a job and wait for a worker to deliver its result"""
         try:
-            # Create a temporary file to store the code
-            with tempfile.NamedTemporaryFile(mode='w', suffix='.py', delete=False) as f:
-                f.write(code)
-                temp_file = f.name
-
-            start_time = time.time()
-            
-            # Execute the code using subprocess with timeout
+            job = await self.submit_job(code, config, cases)
+            # Long enough for every retry to run to its visibility timeout
+            job = await self.wait_for_job(job["id"], job["visibility_timeout"] * job["max_attempts"])
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            return self._worker_failure(e)
+        if job["status"] != "completed":
+            return self._worker_failure(JobQueueError(job["error"] or "job failed"))
+        return job["result"]
+
+    async def _interpreter_version(self, python_path: str) -> str:
+        """Version string of an interpreter, looked up once per path"""
+        if python_path not in self._interpreter_versions:
             try:
-                result = subprocess.run(
-                    ['python', temp_file],
-                    capture_output=True,
-                    text=True,
-                    timeout=self.timeout,
-                    cwd=tempfile.gettempdir()
+                process = await asyncio.create_subprocess_exec(
+                    python_path, "-c", "import sys; print(sys.version)",
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.DEVNULL
                 )
-                
-                execution_time = time.time() - start_time
-                
-                if result.returncode == 0:
-                    return {
-                        "status": "success",
-                        "output": result.stdout,
-                        "error": result.stderr if result.stderr else None,
-                        "execution_time": execution_time
-                    }
-                else:
+                stdout, _ = await process.communicate()
+                self._interpreter_versions[python_path] = stdout.decode().strip()
+            except OSError:
+                return python_path
+        return self._interpreter_versions[python_path]
+
+    async def _cache_key(self, code: str, config: ExecutionConfig, stdin: Optional[str] = None,
+                         args: Optional[List[str]] = None) -> Optional[str]:
+        """Content address of a run, or None when caching does not apply"""
+        if not (self.cache_enabled and config.use_cache):
+            return None
+        return self.cache.make_key(
+            code, stdin or "", list(args or []),
+            config.python_path, await self._interpreter_version(config.python_path),
+            config.timeout, dict(config.limits), dict(config.env)
+        )
+
+    async def _store_result(self, key: Optional[str], result: Dict[str, Any]):
+        # Timeouts and infrastructure failures say nothing about the code itself
+        if key is not None and result["status"] in ("success", "error") and result["output"] is not None:
+            await self.cache.set(key, result)
+
+    async def _precheck(self, code: str, config: ExecutionConfig) -> Tuple[Optional[bytes], Optional[str]]:
+        """
+        Compile code in this process when the target interpreter is the same Python
+
+        Returns:
+            Marshalled bytecode and a syntax error message as from
+            BytecodeCache.compile, or (None, None) when the precheck does not apply
+        """
+        if not self.precheck_enabled or len(code) > self.precheck_max_chars:
+            return None, None
+        if await self._interpreter_version(config.python_path) != sys.version:
+            return None, None
+        with EXECUTOR_STAGE_SECONDS.time(engine=self.engine, stage="precheck"):
+            return self.bytecode_cache.compile(code)
+
+    def _syntax_error_result(self, error: str, config: ExecutionConfig) -> Dict[str, Any]:
+        """The result a sandbox would have produced for code that does not compile"""
+        return self._build_result(1, b"", error, 0.0, False, None, config.max_output_bytes)
+
+    @staticmethod
+    def _build_result(returncode: int, stdout: bytes, stderr: bytes, execution_time: float,
+                      truncated: bool, resource_usage: Optional[Dict[str, Any]],
+                      max_output_bytes: Optional[int]) -> Dict[str, Any]:
+        output = stdout.decode(errors="replace") if isinstance(stdout, bytes) else stdout
+        error = stderr.decode(errors="replace") if isinstance(stderr, bytes) else stderr
+        notes = []
+        if truncated:
+            notes.append(f"Output limit of {max_output_bytes} bytes exceeded; process terminated")
+        elif _describe_exit(returncode):
+            notes.append(_describe_exit(returncode))
+        if notes:
+            error = (error + "\n" if error else "") + "\n".join(notes)
+
+        return {
+            "status": "success" if returncode == 0 and not truncated else "error",
+            "output": output,
+            "error": error if error else None,
+            "execution_time": execution_time,
+            "resource_usage": resource_usage or _empty_resource_usage()
+        }
+
+    @staticmethod
+    def _kill_process_group(process: asyncio.subprocess.Process):
+        """Kill the interpreter together with any children it spawned"""
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+    @staticmethod
+    async def _reap(process: asyncio.subprocess.Process, timeout: float = REAP_TIMEOUT):
+        """
+        Wait for a killed interpreter, discarding whatever output has not been read yet
+
+        Process.wait() also waits for the output pipes to close, and a pipe
+        whose reader buffer is full is paused until someone reads it, so both
+        are drained to EOF. Nothing else may be reading them at the same time.
+        """
+        async def discard(reader: Optional[asyncio.StreamReader]):
+            if reader is not None:
+                while await reader.read(65536):
+                    pass
+
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(discard(process.stdout), discard(process.stderr), process.wait()),
+                timeout=timeout
+            )
+        except asyncio.TimeoutError:
+            # Something outside the killed process group still holds a pipe open
+            print(f"Error reaping interpreter {process.pid}: output pipes still open after {timeout} seconds")
+
+    async def execute_python_code(self, code: str, timeout: int = None, resource_profile: Optional[str] = None,
+                                  config: Optional[ExecutionConfig] = None) -> Dict[str, Any]:
+        """
+        Execute Python code in a secure environment
+
+        Args:
+            code (str): Python code to execute
+            timeout (int, optional): Execution timeout in seconds
+            resource_profile (str, optional): Name of the rlimit profile to apply
+            config (ExecutionConfig, optional): Full per-run settings; overrides
+                timeout and resource_profile when given
+
+        Returns:
+            Dict containing execution results, resource usage and metadata
+        """
+        config = config or self.build_config(timeout, resource_profile)
+        cache_key = await self._cache_key(code, config)
+        if cache_key is not None:
+            cached = await self.cache.get(cache_key)
+            if cached is not None:
+                return {**cached, "cached": True}
+
+        bytecode, syntax_error = await self._precheck(code, config)
+        if syntax_error is not None:
+            return self._syntax_error_result(syntax_error, config)
+
+        if self.engine == "queue":
+            result = await self._run_queued(code, config)
+            await self._store_result(cache_key, result)
+            return result
+
+        async with self._execution_slot():
+            # Warm workers all run the default interpreter
+            if self.engine == "pool" and config.interpreter == DEFAULT_INTERPRETER:
+                result = await self._run_pooled(code, config, bytecode)
+            else:
+                result = await self._run_subprocess(code, config)
+        await self._store_result(cache_key, result)
+        return result
+
+    async def _run_pooled(self, code: str, config: ExecutionConfig,
+                          bytecode: Optional[bytes] = None) -> Dict[str, Any]:
+        """Run code on a pre-started worker interpreter, precompiled when bytecode is given"""
+        try:
+            with self._scratch_directory() as scratch_dir:
+                with EXECUTOR_STAGE_SECONDS.time(engine="pool", stage="run"):
+                    response = await self._get_pool().run(
+                        code, config.timeout, cwd=scratch_dir, limits=dict(config.limits), env=dict(config.env),
+                        bytecode=bytecode
+                    )
+        except asyncio.CancelledError:
+            raise
+        except (WorkerError, asyncio.TimeoutError) as e:
+            return self._worker_failure(e)
+        return self._pooled_result(response, config)
+
+    @staticmethod
+    def _worker_failure(e: Exception) -> Dict[str, Any]:
+        return {
+            "status": "error",
+            "output": None,
+            "error": f"Execution error: {str(e) or 'worker did not respond'}",
+            "execution_time": 0.0,
+            "resource_usage": _empty_resource_usage()
+        }
+
+    def _pooled_result(self, response: Dict[str, Any], config: ExecutionConfig) -> Dict[str, Any]:
+        """Turn a raw worker response into the public result shape"""
+        timeout = config.timeout
+        if response["timed_out"]:
+            return {
+                "status": "timeout",
+                "output": None,
+                "error": f"Code execution timed out after {timeout} seconds",
+                "execution_time": timeout,
+                "resource_usage": response["resource_usage"]
+            }
+
+        return self._build_result(
+            response["returncode"], response["stdout"], response["stderr"], response["execution_time"],
+            response["truncated"], response["resource_usage"], config.max_output_bytes
+        )
+
+    async def execute_batch(self, code: str, cases: List[Dict[str, Any]],
+                            config: Optional[ExecutionConfig] = None) -> Dict[str, Any]:
+        """
+        Run the same code against a list of test cases in parallel
+
+        Code that fails the in-process precheck is not run at all; every
+        case gets the syntax error.
+        With the pool engine the cases are split across workers and each
+        worker compiles the code once, forking a child per case. With the
+        queue engine the cases go to an execution worker as one batch job.
+        Otherwise every case gets its own interpreter, bounded by the
+        concurrency cap.
+
+        Args:
+            code (str): Python code to execute
+            cases (list): Dicts with optional name, stdin, args and expected_output
+            config (ExecutionConfig, optional): Per-run settings shared by all cases
+
+        Returns:
+            Dict with per-case results (in input order) and a pass/fail summary
+        """
+        config = config or self.build_config()
+        start_time = time.time()
+
+        # Only cases without a cached result are executed
+        keys = [await self._cache_key(code, config, case.get("stdin"), case.get("args")) for case in cases]
+        results: List[Optional[Dict[str, Any]]] = []
+        for key in keys:
+            cached = await self.cache.get(key) if key is not None else None
+            results.append({**cached, "cached": True} if cached is not None else None)
+        pending = [index for index, result in enumerate(results) if result is None]
+        pending_cases = [cases[index] for index in pending]
+
+        bytecode, syntax_error = await self._precheck(code, config) if pending_cases else (None, None)
+        if not pending_cases:
+            fresh = []
+        elif syntax_error is not None:
+            fresh = [self._syntax_error_result(syntax_error, config) for _ in pending_cases]
+        elif self.engine == "queue":
+            fresh = await self._run_queued_batch(code, pending_cases, config)
+        elif self.engine == "pool" and config.interpreter == DEFAULT_INTERPRETER:
+            fresh = await self._run_pooled_batch(code, pending_cases, config, bytecode)
+        else:
+            async def run_case(case: Dict[str, Any]) -> Dict[str, Any]:
+                async with self._execution_slot():
+                    return await self._run_subprocess(code, config, case.get("stdin"), case.get("args"))
+            fresh = await asyncio.gather(*[run_case(case) for case in pending_cases])
+
+        for index, result in zip(pending, fresh):
+            results[index] = result
+            await self._store_result(keys[index], result)
+
+        graded = []
+        for index, (case, result) in enumerate(zip(cases, results)):
+            expected = case.get("expected_output")
+            passed = result["status"] == "success" and (
+                expected is None or _normalize_output(result["output"]) == _normalize_output(expected)
+            )
+            graded.append({"name": case.get("name") or f"case_{index + 1}", "passed": passed, **result})
+
+        passed_count = sum(1 for result in graded if result["passed"])
+        return {
+            "status": "success",
+            "results": graded,
+            "summary": {
+                "total": len(graded),
+                "passed": passed_count,
+                "failed": len(graded) - passed_count,
+                "errors": sum(1 for result in graded if result["status"] == "error"),
+                "timeouts": sum(1 for result in graded if result["status"] == "timeout"),
+                "execution_time": sum(result["execution_time"] for result in graded),
+                "wall_time": time.time() - start_time
+            }
+        }
+
+    async def _run_pooled_batch(self, code: str, cases: List[Dict[str, Any]], config: ExecutionConfig,
+                                bytecode: Optional[bytes] = None) -> List[Dict[str, Any]]:
+        """Split cases into contiguous chunks, one pool job per chunk"""
+        pool = self._get_pool()
+        chunk_count = max(1, min(len(cases), pool.max_size, self.max_concurrent))
+        chunk_size = -(-len(cases) // chunk_count)
+        chunks = [cases[i:i + chunk_size] for i in range(0, len(cases), chunk_size)]
+
+        async def run_chunk(chunk: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+            async with self._execution_slot():
+                with ExitStack() as stack:
+                    jobs = [{
+                        "stdin": case.get("stdin"),
+                        "args": case.get("args"),
+                        "cwd": stack.enter_context(self._scratch_directory())
+                    } for case in chunk]
+                    try:
+                        with EXECUTOR_STAGE_SECONDS.time(engine="pool", stage="run"):
+                            responses = await pool.run_batch(
+                                code, jobs, config.timeout, limits=dict(config.limits), env=dict(config.env),
+                                bytecode=bytecode
+                            )
+                    except (WorkerError, asyncio.TimeoutError) as e:
+                        return [self._worker_failure(e) for _ in chunk]
+            return [self._pooled_result(response, config) for response in responses]
+
+        chunk_results = await asyncio.gather(*[run_chunk(chunk) for chunk in chunks])
+        return [result for chunk in chunk_results for result in chunk]
+
+    async def _run_queued_batch(self, code: str, cases: List[Dict[str, Any]],
+                                config: ExecutionConfig) -> List[Dict[str, Any]]:
+        """Run cases as one batch job and unwrap the worker's graded results"""
+        response = await self._run_queued(code, config, cases)
+        if "results" not in response:
+            return [response for _ in cases]
+        # Grading and cache flags are applied again on this side
+        return [
+            {key: value for key, value in result.items() if key not in ("name", "passed", "cached")}
+            for result in response["results"]
+        ]
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Executor configuration and, when enabled, worker pool metrics"""
+        semaphore = self._semaphore
+        return {
+            "engine": self.engine,
+            "max_concurrent": self.max_concurrent,
+            "available_slots": semaphore._value if semaphore is not None else self.max_concurrent,
+            "pool": self._pool.get_metrics() if self._pool is not None else None,
+            "cache": self.cache.get_stats() if self.cache_enabled else None,
+            "bytecode_cache": self.bytecode_cache.get_stats() if self.precheck_enabled else None
+        }
+
+    async def start(self):
+        """Warm up the worker pool when the pool engine is selected"""
+        if self.engine == "pool":
+            await self._get_pool().start()
+
+    async def shutdown(self):
+        if self._local_worker is not None:
+            await self._local_worker.stop()
+        if self._job_queue is not None:
+            await self._job_queue.close()
+        if self._pool is not None:
+            await self._pool.shutdown()
+
+    async def _start_interpreter(self, code: str, scratch_dir: str, config: ExecutionConfig,
+                                 stdin: Optional[str] = None,
+                                 args: Optional[List[str]] = None) -> Tuple[asyncio.subprocess.Process, Optional[bytes], int]:
+        """
+        Start an interpreter for one submission using the configured delivery mode
+
+        Returns:
+            The process, any bytes that still have to be written to its stdin,
+            and the read end of the pipe the runner reports resource usage on
+        """
+        source = code.encode("utf-8")
+        stdin_data = None
+        code_fd = None
+        usage_r, usage_w = os.pipe()
+        pass_fds = (usage_w,)
+        usage_args = ["--usage-fd", str(usage_w)]
+        if config.limits:
+            # Applied by the runner itself: preexec_fn is unsafe in this threaded process
+            usage_args += ["--limits", json.dumps(dict(config.limits))]
+        program_args = ["--"] + list(args) if args else []
+
+        if self.code_delivery == "memfd":
+            # Anonymous in-memory file inherited by the interpreter
+            code_fd = os.memfd_create("submission")
+            os.write(code_fd, source)
+            os.lseek(code_fd, 0, os.SEEK_SET)
+            pass_fds += (code_fd,)
+            command = [RUNNER_SCRIPT, "--fd", str(code_fd)] + usage_args
+        elif self.code_delivery == "tempfile":
+            temp_file = os.path.join(scratch_dir, "main.py")
+            with open(temp_file, "wb") as f:
+                f.write(source)
+            command = [RUNNER_SCRIPT, "--file", temp_file] + usage_args
+        else:
+            # Length-prefixed source; anything after it stays readable by the program
+            stdin_data = str(len(source)).encode() + b"\n" + source
+            command = [RUNNER_SCRIPT] + usage_args
+        if stdin:
+            stdin_data = (stdin_data or b"") + stdin.encode("utf-8")
+
+        try:
+            # Own session so the whole process group can be killed on timeout
+            process = await asyncio.create_subprocess_exec(
+                config.python_path, *command, *program_args,
+                stdin=asyncio.subprocess.PIPE if stdin_data is not None else asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                cwd=scratch_dir,
+                pass_fds=pass_fds,
+                env={**os.environ, **config.env} if config.env else None,
+                start_new_session=True
+            )
+        except BaseException:
+            os.close(usage_r)
+            raise
+        finally:
+            os.close(usage_w)
+            if code_fd is not None:
+                os.close(code_fd)
+        return process, stdin_data, usage_r
+
+    @staticmethod
+    def _read_resource_usage(usage_fd: int) -> Optional[Dict[str, Any]]:
+        """Collect the usage report the runner writes just before it exits"""
+        # Non-blocking: a leftover grandchild may still hold the write end open
+        try:
+            os.set_blocking(usage_fd, False)
+            report = os.read(usage_fd, 65536)
+            return json.loads(report) if report else None
+        except (OSError, ValueError):
+            return None
+        finally:
+            os.close(usage_fd)
+
+    async def _read_capped(self, reader: asyncio.StreamReader, process: asyncio.subprocess.Process,
+                           limit: Optional[int], state: Dict[str, bool]) -> bytes:
+        """Read a pipe to EOF, killing the run once it exceeds ``limit`` bytes"""
+        data = bytearray()
+        while True:
+            chunk = await reader.read(65536)
+            if not chunk:
+                break
+            data += chunk
+            if limit and len(data) > limit:
+                del data[limit:]
+                state["truncated"] = True
+                self._kill_process_group(process)
+                break
+        return bytes(data)
+
+    async def _run_subprocess(self, code: str, config: ExecutionConfig, stdin: Optional[str] = None,
+                              args: Optional[List[str]] = None) -> Dict[str, Any]:
+        """Run code in a fresh interpreter without blocking the event loop"""
+        timeout = config.timeout
+        max_output_bytes = config.max_output_bytes
+        try:
+            with self._scratch_directory() as scratch_dir:
+                with EXECUTOR_STAGE_SECONDS.time(engine="subprocess", stage="spawn"):
+                    process, stdin_data, usage_fd = await self._start_interpreter(code, scratch_dir, config, stdin, args)
+                start_time = time.perf_counter()
+                state = {"truncated": False}
+
+                async def feed_stdin():
+                    if stdin_data is not None:
+                        try:
+                            process.stdin.write(stdin_data)
+                            await process.stdin.drain()
+                            process.stdin.close()
+                        except (BrokenPipeError, ConnectionResetError):
+                            pass
+
+                try:
+                    _, stdout, stderr, _ = await asyncio.wait_for(asyncio.gather(
+                        feed_stdin(),
+                        self._read_capped(process.stdout, process, max_output_bytes, state),
+                        self._read_capped(process.stderr, process, max_output_bytes, state),
+                        process.wait()
+                    ), timeout=timeout)
+                except asyncio.TimeoutError:
+                    self._kill_process_group(process)
+                    await self._reap(process)
+                    os.close(usage_fd)
                     return {
-                        "status": "error",
-                        "output": result.stdout,
-                        "error": result.stderr,
-                        "execution_time": execution_time
+                        "status": "timeout",
+                        "output": None,
+                        "error": f"Code execution timed out after {timeout} seconds",
+                        "execution_time": timeout,
+                        "resource_usage": _empty_resource_usage()
                     }
-                    
-            except subprocess.TimeoutExpired:
-                return {
-                    "status": "timeout",
-                    "output": None,
-                    "error": f"Code execution timed out after {self.timeout} seconds",
-                    "execution_time": self.timeout
-                }
-            finally:
-                # Clean up temporary file
-                try:
-                    os.unlink(temp_file)
-                except:
-                    pass
+                except asyncio.CancelledError:
+                    # Client went away; do not leave the interpreter running
+                    self._kill_process_group(process)
+                    await self._reap(process)
+                    os.close(usage_fd)
+                    raise
+
+                execution_time = time.perf_counter() - start_time
+                EXECUTOR_STAGE_SECONDS.observe(execution_time, engine="subprocess", stage="run")
+                return self._build_result(
+                    process.returncode, stdout, stderr, execution_time,
+                    state["truncated"], self._read_resource_usage(usage_fd), max_output_bytes
+                )
 
+        except asyncio.CancelledError:
+            raise
         except Exception as e:
             return {
                 "status": "error",
                 "output": None,
                 "error": f"Execution error: {str(e)}",
-                "execution_time": 0.0
+                "execution_time": 0.0,
+                "resource_usage": _empty_resource_usage()
             }
 
+    async def stream_python_code(self, code: str, timeout: int = None, resource_profile: Optional[str] = None,
+                                 config: Optional[ExecutionConfig] = None,
+                                 chunk_size: int = 4096) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Execute Python code and yield output as it is produced
+
+        Output events are queued through a small bounded buffer, so a slow
+        consumer stops the pipes from being read and the program blocks on
+        write instead of the server buffering without limit. The timeout is
+        enforced by a watchdog, so it holds however slowly events are taken.
+
+        Args:
+            code (str): Python code to execute
+            timeout (int, optional): Execution timeout in seconds
+            resource_profile (str, optional): Name of the rlimit profile to apply
+            config (ExecutionConfig, optional): Full per-run settings
+            chunk_size (int): Maximum bytes read from a pipe at a time
+
+        Yields:
+            ``output`` events with stream name and text, ``output_truncated``
+            when a stream exceeds the profile's output cap (the run is then
+            terminated), and a final ``execution_complete`` event with status,
+            execution_time and resource_usage
+        """
+        config = config or self.build_config(timeout, resource_profile)
+        timeout = config.timeout
+        limit = config.max_output_bytes or float("inf")
+
+        _, syntax_error = await self._precheck(code, config)
+        if syntax_error is not None:
+            yield {"type": "output", "stream": "stderr", "content": syntax_error}
+            yield {
+                "type": "execution_complete",
+                "status": "error",
+                "returncode": 1,
+                "error": None,
+                "truncated": {"stdout": False, "stderr": False},
+                "execution_time": 0.0,
+                "resource_usage": _empty_resource_usage()
+            }
+            return
+
+        async with self._execution_slot():
+            with self._scratch_directory() as scratch_dir:
+                with EXECUTOR_STAGE_SECONDS.time(engine="subprocess", stage="spawn"):
+                    process, stdin_data, usage_fd = await self._start_interpreter(code, scratch_dir, config)
+                start_time = time.time()
+                events: asyncio.Queue = asyncio.Queue(maxsize=16)
+                truncated = {"stdout": False, "stderr": False}
+
+                async def pump(reader: asyncio.StreamReader, name: str):
+                    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+                    sent = 0
+                    while True:
+                        chunk = await reader.read(chunk_size)
+                        if not chunk:
+                            break
+                        if truncated[name]:
+                            continue
+                        if sent + len(chunk) > limit:
+                            chunk = chunk[:limit - sent]
+                            truncated[name] = True
+                            self._kill_process_group(process)
+                        sent += len(chunk)
+                        text = decoder.decode(chunk, final=truncated[name])
+                        if text:
+                            await events.put({"type": "output", "stream": name, "content": text})
+                        if truncated[name]:
+                            await events.put({"type": "output_truncated", "stream": name, "limit": limit})
+                    tail = decoder.decode(b"", final=True)
+                    if tail:
+                        await events.put({"type": "output", "stream": name, "content": tail})
+                    await events.put(None)
+
+                timed_out = False
+
+                async def watchdog():
+                    nonlocal timed_out
+                    await asyncio.sleep(timeout)
+                    timed_out = True
+                    self._kill_process_group(process)
+
+                pumps = [
+                    asyncio.ensure_future(pump(process.stdout, "stdout")),
+                    asyncio.ensure_future(pump(process.stderr, "stderr"))
+                ]
+                killer = asyncio.ensure_future(watchdog())
+                status = None
+                try:
+                    if stdin_data is not None:
+                        try:
+                            process.stdin.write(stdin_data)
+                            await process.stdin.drain()
+                            process.stdin.close()
+                        except (BrokenPipeError, ConnectionResetError):
+                            pass
+
+                    deadline = start_time + timeout
+                    open_streams = len(pumps)
+                    while open_streams:
+                        remaining = deadline - time.time()
+                        if remaining <= 0 or timed_out:
+                            status = "timeout"
+                            break
+                        try:
+                            event = await asyncio.wait_for(events.get(), timeout=remaining)
+                        except asyncio.TimeoutError:
+                            status = "timeout"
+                            break
+                        if event is None:
+                            open_streams -= 1
+                        else:
+                            yield event
+
+                    if status is None and timed_out:
+                        status = "timeout"
+                    elif status is None:
+                        try:
+                            await asyncio.wait_for(process.wait(), timeout=max(deadline - time.time(), 0.001))
+                            exceeded = truncated["stdout"] or truncated["stderr"]
+                            status = "success" if process.returncode == 0 and not exceeded else "error"
+                        except asyncio.TimeoutError:
+                            status = "timeout"
+                finally:
+                    # Also reached when the consumer stops iterating early
+                    killer.cancel()
+                    if process.returncode is None:
+                        self._kill_process_group(process)
+                    for task in pumps:
+                        task.cancel()
+                    # The pumps must stop reading before the pipes are drained
+                    await asyncio.gather(*pumps, return_exceptions=True)
+                    await self._reap(process)
+                    resource_usage = self._read_resource_usage(usage_fd)
+
+                if status == "timeout":
+                    error = f"Code execution timed out after {timeout} seconds"
+                elif truncated["stdout"] or truncated["stderr"]:
+                    error = f"Output limit of {limit} bytes exceeded; process terminated"
+                else:
+                    error = _describe_exit(process.returncode)
+
+                yield {
+                    "type": "execution_complete",
+                    "status": status,
+                    "returncode": process.returncode,
+                    "error": error,
+                    "truncated": truncated,
+                    "execution_time": timeout if status == "timeout" else time.time() - start_time,
+                    "resource_usage": resource_usage or _empty_resource_usage()
+                }
+
 # Global instance
 code_executor = CodeExecutor()
@@ -0,0 +1,181 @@
+import asyncio
+import json
+import os
+import time
+from typing import Any, Dict, Optional
+
+from fastapi import WebSocket
+
+class Connection:
+    """One WebSocket with its outbound queue and the task that drains it"""
+
+    __slots__ = ("websocket", "endpoint", "queue", "sender", "connected_at", "last_seen", "dropped", "closed",
+                 "closed_event")
+
+    def __init__(self, websocket: WebSocket, endpoint: str, max_queue_size: int):
+        self.websocket = websocket
+        self.endpoint = endpoint
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue_size)
+        self.sender: Optional[asyncio.Task] = None
+        self.connected_at = time.monotonic()
+        self.last_seen = self.connected_at
+        self.dropped = 0
+        self.closed = False
+        # Set together with ``closed`` so senders waiting for queue room wake up
+        self.closed_event = asyncio.Event()
+
+    def close(self):
+        self.closed = True
+        self.closed_event.set()
+
+
+class ConnectionManager:
+    """
+    Registry of open WebSockets with bounded per-connection send queues
+
+    Messages are queued and written by a sender task per connection, so a
+    slow client never stalls the handler producing its messages. When a
+    queue is full, ``send_nowait`` drops the oldest message (newer
+    suggestions supersede older ones) while ``send`` waits for room, for
+    streams where the producer should be slowed down instead or where every
+    message matters, such as suggestion deltas. A heartbeat
+    sends ``{"type": "ping"}`` to every client and closes connections that
+    have sent nothing, pongs included, for ``idle_timeout`` seconds.
+    """
+
+    def __init__(self, max_queue_size: Optional[int] = None, ping_interval: Optional[float] = None,
+                 idle_timeout: Optional[float] = None):
+        self.max_queue_size = max_queue_size or int(os.getenv("WS_SEND_QUEUE_SIZE", "64"))
+        self.ping_interval = ping_interval or float(os.getenv("WS_PING_INTERVAL", "20"))
+        self.idle_timeout = idle_timeout or float(os.getenv("WS_IDLE_TIMEOUT", "300"))
+        # Keyed by id(): Starlette WebSockets compare as mappings and are not hashable
+        self.connections: Dict[int, Connection] = {}
+        self._heartbeat: Optional[asyncio.Task] = None
+
+        self.connected_total = 0
+        self.sent_total = 0
+        self.dropped_total = 0
+        self.evicted_total = 0
+
+    async def connect(self, websocket: WebSocket, endpoint: str = "default") -> Connection:
+        await websocket.accept()
+        connection = Connection(websocket, endpoint, self.max_queue_size)
+        connection.sender = asyncio.create_task(self._send_loop(connection))
+        self.connections[id(websocket)] = connection
+        self.connected_total += 1
+        if self._heartbeat is None or self._heartbeat.done():
+            self._heartbeat = asyncio.create_task(self._heartbeat_loop())
+        return connection
+
+    def disconnect(self, websocket: WebSocket):
+        """Forget a connection; safe to call more than once"""
+        connection = self.connections.pop(id(websocket), None)
+        if connection is None:
+            return
+        connection.close()
+        if connection.sender is not None:
+            connection.sender.cancel()
+        if not self.connections and self._heartbeat is not None:
+            self._heartbeat.cancel()
+            self._heartbeat = None
+
+    def touch(self, websocket: WebSocket):
+        """Record that the client sent something, so it is not evicted as idle"""
+        connection = self.connections.get(id(websocket))
+        if connection is not None:
+            connection.last_seen = time.monotonic()
+
+    def send_nowait(self, websocket: WebSocket, message: str) -> bool:
+        """
+        Queue a message, dropping the oldest queued one if the queue is full
+
+        Returns:
+            False if the connection is already closed
+        """
+        connection = self.connections.get(id(websocket))
+        if connection is None or connection.closed:
+            return False
+        if connection.queue.full():
+            connection.queue.get_nowait()
+            connection.dropped += 1
+            self.dropped_total += 1
+        connection.queue.put_nowait(message)
+        return True
+
+    async def send(self, websocket: WebSocket, message: str) -> bool:
+        """
+        Queue a message, waiting while the queue is full
+
+        Returns:
+            False if the connection is closed, including while waiting for room
+        """
+        connection = self.connections.get(id(websocket))
+        if connection is None or connection.closed:
+            return False
+        if not connection.queue.full():
+            connection.queue.put_nowait(message)
+            return True
+        # A stalled client's sender is cancelled on eviction, so the queue may never drain
+        put = asyncio.ensure_future(connection.queue.put(message))
+        closed = asyncio.ensure_future(connection.closed_event.wait())
+        try:
+            await asyncio.wait({put, closed}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            put.cancel()
+            closed.cancel()
+        return put.done() and not put.cancelled() and not connection.closed
+
+    async def send_suggestion(self, message: str, websocket: WebSocket):
+        self.send_nowait(websocket, message)
+
+    async def _send_loop(self, connection: Connection):
+        while True:
+            message = await connection.queue.get()
+            try:
+                await connection.websocket.send_text(message)
+            except Exception:
+                # The client is gone; the handler notices on its next receive
+                connection.close()
+                return
+            self.sent_total += 1
+
+    async def _heartbeat_loop(self):
+        ping = json.dumps({"type": "ping"})
+        while True:
+            await asyncio.sleep(self.ping_interval)
+            now = time.monotonic()
+            for connection in list(self.connections.values()):
+                if now - connection.last_seen > self.idle_timeout:
+                    await self._evict(connection)
+                else:
+                    self.send_nowait(connection.websocket, ping)
+
+    async def _evict(self, connection: Connection):
+        self.evicted_total += 1
+        self.disconnect(connection.websocket)
+        try:
+            await connection.websocket.close(code=1001)
+        except Exception:
+            pass
+
+    def get_stats(self) -> Dict[str, Any]:
+        depths = [connection.queue.qsize() for connection in self.connections.values()]
+        by_endpoint: Dict[str, int] = {}
+        for connection in self.connections.values():
+            by_endpoint[connection.endpoint] = by_endpoint.get(connection.endpoint, 0) + 1
+        return {
+            "connections": len(self.connections),
+            "by_endpoint": by_endpoint,
+            "queued_messages": sum(depths),
+            "max_queue_depth": max(depths, default=0),
+            "max_queue_size": self.max_queue_size,
+            "ping_interval": self.ping_interval,
+            "idle_timeout": self.idle_timeout,
+            "connected_total": self.connected_total,
+            "sent_total": self.sent_total,
+            "dropped_total": self.dropped_total,
+            "evicted_total": self.evicted_total
+        }
+
+# Global instance
+manager = ConnectionManager()
@@ -0,0 +1,173 @@
+import asyncio
+import os
+import queue
+import threading
+import time
+from typing import Any, Callable, Optional
+
+from app.services.metrics import QUEUE_WAIT_SECONDS
+
+class InferenceQueueFull(Exception):
+    """Raised when too many inference requests are already waiting"""
+
+
+class InferenceDeadlineExceeded(Exception):
+    """Raised when a request's deadline passed before it could start or cut its generation short"""
+
+
+class InferenceJob:
+    """A unit of blocking model work plus the signals it should poll while running"""
+
+    def __init__(self, fn: Callable[["InferenceJob"], Any], deadline: Optional[float],
+                 loop: asyncio.AbstractEventLoop):
+        self.fn = fn
+        self.deadline = deadline
+        self.loop = loop
+        self.future: asyncio.Future = loop.create_future()
+        self.cancelled = threading.Event()
+        self.enqueued_at = time.monotonic()
+        self.started_at: Optional[float] = None
+        # Why generation was cut short, once should_stop has said so: "cancelled" or "deadline"
+        self.stop_reason: Optional[str] = None
+
+    @property
+    def expired(self) -> bool:
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    def should_stop(self) -> bool:
+        """Polled by generation between tokens"""
+        if self.cancelled.is_set():
+            self.stop_reason = "cancelled"
+        elif self.expired:
+            self.stop_reason = "deadline"
+        return self.stop_reason is not None
+
+
+class InferenceExecutor:
+    """
+    Runs blocking model calls on a dedicated thread
+
+    Async callers await ``run`` while generation happens off the event loop,
+    so health checks and code execution keep being served during inference.
+    The queue is bounded, queued requests past their deadline are dropped,
+    and cancelling the awaiting coroutine (for example when a WebSocket
+    client disconnects) signals the running job to stop.
+    """
+
+    def __init__(self, max_queue_depth: Optional[int] = None, default_timeout: Optional[float] = None):
+        self.max_queue_depth = max_queue_depth or int(os.getenv("LLM_MAX_QUEUE_DEPTH", "32"))
+        self.default_timeout = default_timeout or float(os.getenv("LLM_REQUEST_TIMEOUT", "120"))
+        self._queue: "queue.Queue[Optional[InferenceJob]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._depth = 0
+
+        self.completed_total = 0
+        self.rejected_total = 0
+        self.expired_total = 0
+        self.cancelled_total = 0
+
+    def _ensure_thread(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._worker, name="inference-worker", daemon=True)
+                self._thread.start()
+
+    def _worker(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                break
+            if job.cancelled.is_set():
+                self.cancelled_total += 1
+                self._finish(job)
+                continue
+            if job.expired:
+                self.expired_total += 1
+                self._finish(job, exception=InferenceDeadlineExceeded("Request expired while queued"))
+                continue
+            job.started_at = time.monotonic()
+            QUEUE_WAIT_SECONDS.observe(job.started_at - job.enqueued_at, queue="inference")
+            try:
+                result = job.fn(job)
+            except Exception as e:
+                self._finish(job, exception=e)
+            else:
+                if job.cancelled.is_set():
+                    self.cancelled_total += 1
+                elif job.stop_reason == "deadline":
+                    # Truncated output must not pass for (or be cached as) a complete answer
+                    self.expired_total += 1
+                    self._finish(job, exception=InferenceDeadlineExceeded("Generation stopped at the request deadline"))
+                    continue
+                else:
+                    self.completed_total += 1
+                self._finish(job, result=result)
+
+    def _finish(self, job: InferenceJob, result: Any = None, exception: Optional[BaseException] = None):
+        with self._lock:
+            self._depth -= 1
+
+        def resolve():
+            if job.future.done():
+                return
+            if job.cancelled.is_set():
+                # Nobody is awaiting the result any more
+                job.future.cancel()
+            elif exception is not None:
+                job.future.set_exception(exception)
+            else:
+                job.future.set_result(result)
+
+        try:
+            job.loop.call_soon_threadsafe(resolve)
+        except RuntimeError:
+            # Event loop already closed during shutdown
+            pass
+
+    async def run(self, fn: Callable[[InferenceJob], Any], timeout: Optional[float] = None) -> Any:
+        """
+        Run ``fn(job)`` on the inference thread and wait for its result
+
+        Args:
+            fn: Blocking callable; long-running work should poll ``job.should_stop()``
+            timeout (float, optional): Seconds until the request's deadline
+
+        Returns:
+            Whatever ``fn`` returns
+
+        Raises:
+            InferenceQueueFull: If ``max_queue_depth`` requests are already pending
+            InferenceDeadlineExceeded: If the deadline passed before the job started,
+                or generation polling ``job.should_stop()`` was stopped by it
+        """
+        with self._lock:
+            if self._depth >= self.max_queue_depth:
+                self.rejected_total += 1
+                raise InferenceQueueFull(f"Inference queue is full ({self.max_queue_depth} pending)")
+            self._depth += 1
+
+        self._ensure_thread()
+        timeout = timeout or self.default_timeout
+        job = InferenceJob(fn, time.monotonic() + timeout, asyncio.get_running_loop())
+        self._queue.put(job)
+        try:
+            return await asyncio.shield(job.future)
+        except asyncio.CancelledError:
+            # Stops the job if queued, or at the next token if already generating
+            job.cancelled.set()
+            raise
+
+    def get_stats(self) -> dict:
+        return {
+            "queue_depth": self._depth,
+            "max_queue_depth": self.max_queue_depth,
+            "completed_total": self.completed_total,
+            "rejected_total": self.rejected_total,
+            "expired_total": self.expired_total,
+            "cancelled_total": self.cancelled_total
+        }
+
+    def shutdown(self):
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(None)
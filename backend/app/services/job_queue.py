@@ -0,0 +1,482 @@
+import asyncio
+import json
+import os
+import time
+import uuid
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional
+
+# Terminal job states; anything else is still queued or running
+FINISHED_STATUSES = ("completed", "dead")
+
+class JobQueueError(Exception):
+    """Raised when a job cannot be submitted or its result is not available"""
+
+
+def _new_job(queue: str, kind: str, payload: Dict[str, Any], max_attempts: int,
+             visibility_timeout: float) -> Dict[str, Any]:
+    return {
+        "id": uuid.uuid4().hex,
+        "queue": queue,
+        "kind": kind,
+        "payload": payload,
+        "status": "queued",
+        "attempts": 0,
+        "max_attempts": max_attempts,
+        "visibility_timeout": visibility_timeout,
+        "created_at": time.time(),
+        "started_at": None,
+        "finished_at": None,
+        "worker": None,
+        "result": None,
+        "error": None
+    }
+
+
+class JobQueue:
+    """
+    At-least-once job queue shared by API processes and execution workers
+
+    A claimed job becomes invisible to other workers for its visibility
+    timeout. Jobs that are not completed in time, or whose worker reports a
+    failure, go back to the queue until ``max_attempts`` is reached and are
+    then dead-lettered. Subclasses provide the storage.
+    """
+
+    def __init__(self, max_attempts: Optional[int] = None, result_ttl: Optional[float] = None):
+        self.max_attempts = max_attempts or int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+        self.result_ttl = result_ttl or float(os.getenv("JOB_RESULT_TTL", "3600"))
+
+    async def enqueue(self, queue: str, kind: str, payload: Dict[str, Any],
+                      visibility_timeout: float) -> Dict[str, Any]:
+        """
+        Add a job to a queue
+
+        Args:
+            queue (str): Queue name; workers subscribe to queues by name
+            kind (str): Handler the worker should run the job with
+            payload (dict): JSON-serialisable job input
+            visibility_timeout (float): Seconds a worker may hold the job before it is retried
+
+        Returns:
+            The new job record
+        """
+        raise NotImplementedError
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    async def claim(self, queue: str, worker_id: str, block: float = 1.0) -> Optional[Dict[str, Any]]:
+        """
+        Take the oldest pending job, waiting up to ``block`` seconds for one
+
+        Returns None on timeout, and also when the id taken belongs to a job
+        that already finished: a job whose visibility timeout expired can be
+        queued again and still complete on its first run.
+        """
+        raise NotImplementedError
+
+    async def complete(self, job: Dict[str, Any], result: Dict[str, Any]):
+        raise NotImplementedError
+
+    async def fail(self, job: Dict[str, Any], error: str):
+        """Report a failed attempt; the job is retried or dead-lettered"""
+        raise NotImplementedError
+
+    async def requeue_expired(self, queue: str) -> int:
+        """Return jobs whose visibility timeout passed to the queue; returns how many"""
+        raise NotImplementedError
+
+    async def wait(self, job_id: str, timeout: float) -> Dict[str, Any]:
+        """
+        Wait for a job to finish
+
+        Raises:
+            JobQueueError: If the job is unknown or not finished within ``timeout``
+        """
+        raise NotImplementedError
+
+    async def get_stats(self, queues: List[str]) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+class InMemoryJobQueue(JobQueue):
+    """Single-process stand-in for RedisJobQueue, used when no REDIS_URL is set"""
+
+    def __init__(self, max_attempts: Optional[int] = None, result_ttl: Optional[float] = None):
+        super().__init__(max_attempts, result_ttl)
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._pending: Dict[str, Deque[str]] = {}
+        self._deadlines: Dict[str, Dict[str, float]] = {}
+        self._dead: Dict[str, List[str]] = {}
+        self._condition: Optional[asyncio.Condition] = None
+
+    def _get_condition(self) -> asyncio.Condition:
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+
+    async def _notify(self):
+        condition = self._get_condition()
+        async with condition:
+            condition.notify_all()
+
+    def _expire_results(self):
+        cutoff = time.time() - self.result_ttl
+        for job_id in [job_id for job_id, job in self._jobs.items()
+                       if job["finished_at"] is not None and job["finished_at"] < cutoff]:
+            del self._jobs[job_id]
+
+    async def enqueue(self, queue: str, kind: str, payload: Dict[str, Any],
+                      visibility_timeout: float) -> Dict[str, Any]:
+        self._expire_results()
+        job = _new_job(queue, kind, payload, self.max_attempts, visibility_timeout)
+        self._jobs[job["id"]] = job
+        self._pending.setdefault(queue, deque()).append(job["id"])
+        await self._notify()
+        return dict(job)
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        job = self._jobs.get(job_id)
+        return dict(job) if job is not None else None
+
+    async def claim(self, queue: str, worker_id: str, block: float = 1.0) -> Optional[Dict[str, Any]]:
+        pending = self._pending.setdefault(queue, deque())
+        condition = self._get_condition()
+        try:
+            async with condition:
+                await asyncio.wait_for(condition.wait_for(lambda: bool(pending)), timeout=block)
+                job = self._jobs.get(pending.popleft())
+        except asyncio.TimeoutError:
+            return None
+        if job is None or job["status"] in FINISHED_STATUSES:
+            return None
+        job.update(status="running", attempts=job["attempts"] + 1, started_at=time.time(), worker=worker_id)
+        self._deadlines.setdefault(queue, {})[job["id"]] = time.monotonic() + job["visibility_timeout"]
+        return dict(job)
+
+    async def _finish(self, job_id: str, **fields):
+        self._jobs[job_id].update(finished_at=time.time(), **fields)
+        await self._notify()
+
+    async def complete(self, job: Dict[str, Any], result: Dict[str, Any]):
+        self._deadlines.get(job["queue"], {}).pop(job["id"], None)
+        await self._finish(job["id"], status="completed", result=result, error=None)
+
+    async def _retry_or_dead(self, job_id: str, error: str):
+        job = self._jobs[job_id]
+        if job["attempts"] >= job["max_attempts"]:
+            self._dead.setdefault(job["queue"], []).append(job_id)
+            await self._finish(job_id, status="dead", error=error)
+        else:
+            job.update(status="queued", error=error, worker=None)
+            self._pending.setdefault(job["queue"], deque()).append(job_id)
+            await self._notify()
+
+    async def fail(self, job: Dict[str, Any], error: str):
+        if self._deadlines.get(job["queue"], {}).pop(job["id"], None) is not None:
+            await self._retry_or_dead(job["id"], error)
+
+    async def requeue_expired(self, queue: str) -> int:
+        deadlines = self._deadlines.get(queue, {})
+        now = time.monotonic()
+        expired = [job_id for job_id, deadline in deadlines.items() if deadline <= now]
+        for job_id in expired:
+            del deadlines[job_id]
+            await self._retry_or_dead(job_id, "Visibility timeout expired")
+        return len(expired)
+
+    async def wait(self, job_id: str, timeout: float) -> Dict[str, Any]:
+        if job_id not in self._jobs:
+            raise JobQueueError(f"Unknown job: {job_id}")
+        condition = self._get_condition()
+        try:
+            async with condition:
+                await asyncio.wait_for(
+                    condition.wait_for(lambda: self._jobs[job_id]["status"] in FINISHED_STATUSES),
+                    timeout=timeout
+                )
+        except asyncio.TimeoutError:
+            raise JobQueueError(f"Job {job_id} did not finish within {timeout} seconds")
+        return dict(self._jobs[job_id])
+
+    async def get_stats(self, queues: List[str]) -> Dict[str, Any]:
+        return {
+            "backend": "memory",
+            "queues": {
+                queue: {
+                    "pending": len(self._pending.get(queue, ())),
+                    "processing": len(self._deadlines.get(queue, {})),
+                    "dead": len(self._dead.get(queue, ()))
+                }
+                for queue in queues
+            }
+        }
+
+
+class RedisJobQueue(JobQueue):
+    """
+    Job queue stored in Redis so API processes and workers can run on any node
+
+    Pending job ids live in a list per queue and are moved atomically to a
+    processing list when claimed (BLMOVE), so a job is never lost between the
+    two. A sorted set holds each claimed job's visibility deadline, and
+    removing from it is what entitles a process to retry or finish the job,
+    so two reapers cannot requeue the same job twice.
+    """
+
+    def __init__(self, redis_url: str, max_attempts: Optional[int] = None, result_ttl: Optional[float] = None):
+        super().__init__(max_attempts, result_ttl)
+        import redis.asyncio as redis_asyncio
+        self.redis = redis_asyncio.from_url(redis_url, decode_responses=True)
+
+    @staticmethod
+    def _key(queue: str, part: str) -> str:
+        return f"jobs:{queue}:{part}"
+
+    @staticmethod
+    def _job_key(job_id: str) -> str:
+        return f"job:{job_id}"
+
+    async def _save(self, job: Dict[str, Any], ttl: Optional[float] = None):
+        await self.redis.set(self._job_key(job["id"]), json.dumps(job), ex=int(ttl) if ttl else None)
+
+    async def enqueue(self, queue: str, kind: str, payload: Dict[str, Any],
+                      visibility_timeout: float) -> Dict[str, Any]:
+        job = _new_job(queue, kind, payload, self.max_attempts, visibility_timeout)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.set(self._job_key(job["id"]), json.dumps(job))
+            pipe.lpush(self._key(queue, "pending"), job["id"])
+            await pipe.execute()
+        return job
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        payload = await self.redis.get(self._job_key(job_id))
+        return json.loads(payload) if payload is not None else None
+
+    async def claim(self, queue: str, worker_id: str, block: float = 1.0) -> Optional[Dict[str, Any]]:
+        job_id = await self.redis.blmove(
+            self._key(queue, "pending"), self._key(queue, "processing"), block, "RIGHT", "LEFT"
+        )
+        if job_id is None:
+            return None
+        from redis.exceptions import WatchError
+
+        async with self.redis.pipeline(transaction=True) as pipe:
+            while True:
+                try:
+                    # Watched so a run completing between the read and the write is not overwritten
+                    await pipe.watch(self._job_key(job_id))
+                    payload = await pipe.get(self._job_key(job_id))
+                    job = json.loads(payload) if payload is not None else None
+                    if job is None or job["status"] in FINISHED_STATUSES:
+                        # Record expired, or a requeued copy of a job that already finished
+                        await pipe.unwatch()
+                        await self.redis.lrem(self._key(queue, "processing"), 1, job_id)
+                        return None
+                    job.update(status="running", attempts=job["attempts"] + 1, started_at=time.time(), worker=worker_id)
+                    pipe.multi()
+                    pipe.zadd(self._key(queue, "deadlines"), {job_id: time.time() + job["visibility_timeout"]})
+                    pipe.set(self._job_key(job_id), json.dumps(job))
+                    await pipe.execute()
+                    return job
+                except WatchError:
+                    continue
+
+    async def _release(self, job: Dict[str, Any]) -> bool:
+        """Take ownership of a claimed job back from the processing set"""
+        owned = await self.redis.zrem(self._key(job["queue"], "deadlines"), job["id"])
+        if owned:
+            await self.redis.lrem(self._key(job["queue"], "processing"), 1, job["id"])
+        return bool(owned)
+
+    async def _finish(self, job: Dict[str, Any]):
+        job["finished_at"] = time.time()
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.set(self._job_key(job["id"]), json.dumps(job), ex=int(self.result_ttl))
+            # Wakes anyone blocked in wait()
+            pipe.lpush(self._job_key(job["id"]) + ":done", 1)
+            pipe.expire(self._job_key(job["id"]) + ":done", int(self.result_ttl))
+            await pipe.execute()
+
+    async def complete(self, job: Dict[str, Any], result: Dict[str, Any]):
+        # A job that already timed out and was requeued may still finish here first;
+        # delivery is at least once, so the result is stored either way
+        await self._release(job)
+        job.update(status="completed", result=result, error=None)
+        await self._finish(job)
+
+    async def _retry_or_dead(self, job: Dict[str, Any], error: str):
+        if job["attempts"] >= job["max_attempts"]:
+            job.update(status="dead", error=error)
+            await self.redis.lpush(self._key(job["queue"], "dead"), job["id"])
+            await self._finish(job)
+        else:
+            job.update(status="queued", error=error, worker=None)
+            async with self.redis.pipeline(transaction=True) as pipe:
+                pipe.set(self._job_key(job["id"]), json.dumps(job))
+                pipe.lpush(self._key(job["queue"], "pending"), job["id"])
+                await pipe.execute()
+
+    async def fail(self, job: Dict[str, Any], error: str):
+        if await self._release(job):
+            await self._retry_or_dead(job, error)
+
+    async def requeue_expired(self, queue: str) -> int:
+        now = time.time()
+        deadlines = self._key(queue, "deadlines")
+        requeued = 0
+        for job_id in await self.redis.zrangebyscore(deadlines, 0, now):
+            job = await self.get(job_id)
+            if job is None:
+                await self.redis.zrem(deadlines, job_id)
+                continue
+            if await self._release(job):
+                await self._retry_or_dead(job, "Visibility timeout expired")
+                requeued += 1
+
+        # A worker that died between BLMOVE and ZADD leaves an id with no deadline
+        for job_id in await self.redis.lrange(self._key(queue, "processing"), 0, -1):
+            if await self.redis.zscore(deadlines, job_id) is None:
+                job = await self.get(job_id)
+                visibility = job["visibility_timeout"] if job else 0
+                await self.redis.zadd(deadlines, {job_id: now + visibility}, nx=True)
+        return requeued
+
+    async def wait(self, job_id: str, timeout: float) -> Dict[str, Any]:
+        deadline = time.monotonic() + timeout
+        done_key = self._job_key(job_id) + ":done"
+        while True:
+            job = await self.get(job_id)
+            if job is None:
+                raise JobQueueError(f"Unknown job: {job_id}")
+            if job["status"] in FINISHED_STATUSES:
+                return job
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise JobQueueError(f"Job {job_id} did not finish within {timeout} seconds")
+            # Short blocking pops so several waiters on one job all notice it finishing
+            if await self.redis.blpop(done_key, timeout=max(1, min(int(remaining), 5))):
+                await self.redis.lpush(done_key, 1)
+
+    async def get_stats(self, queues: List[str]) -> Dict[str, Any]:
+        stats = {}
+        for queue in queues:
+            stats[queue] = {
+                "pending": await self.redis.llen(self._key(queue, "pending")),
+                "processing": await self.redis.zcard(self._key(queue, "deadlines")),
+                "dead": await self.redis.llen(self._key(queue, "dead"))
+            }
+        return {"backend": "redis", "queues": stats}
+
+    async def close(self):
+        await self.redis.close()
+
+
+def job_queue_from_env() -> JobQueue:
+    """RedisJobQueue when ``REDIS_URL`` is set, otherwise the in-memory queue"""
+    redis_url = os.getenv("REDIS_URL")
+    if redis_url:
+        return RedisJobQueue(redis_url)
+    return InMemoryJobQueue()
+
+
+def parse_queue_concurrency(spec: str) -> Dict[str, int]:
+    """Parse ``"execute:4,batch:2"`` into per-queue slot counts"""
+    concurrency = {}
+    for entry in spec.split(","):
+        if not entry.strip():
+            continue
+        name, _, slots = entry.partition(":")
+        concurrency[name.strip()] = int(slots or 1)
+    return concurrency
+
+
+class JobWorker:
+    """
+    Pulls jobs from one or more queues and runs them with per-queue concurrency
+
+    Each queue gets its own number of slots, so a flood of batch jobs cannot
+    starve single executions. Handlers are looked up by job kind; an exception
+    from a handler counts as a failed attempt.
+    """
+
+    def __init__(self, queue: JobQueue, handlers: Dict[str, Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]]],
+                 concurrency: Dict[str, int], worker_id: Optional[str] = None, reap_interval: float = 5.0):
+        self.queue = queue
+        self.handlers = handlers
+        self.concurrency = concurrency
+        self.worker_id = worker_id or f"{os.uname().nodename}-{os.getpid()}"
+        self.reap_interval = reap_interval
+        self._tasks: List[asyncio.Task] = []
+        self._stopping = False
+
+        self.completed_total = 0
+        self.failed_total = 0
+
+    async def _run_slot(self, queue_name: str):
+        while not self._stopping:
+            try:
+                job = await self.queue.claim(queue_name, self.worker_id)
+            except Exception as e:
+                print(f"Error claiming job from {queue_name}: {str(e)}")
+                await asyncio.sleep(1.0)
+                continue
+            if job is None:
+                continue
+
+            handler = self.handlers.get(job["kind"])
+            try:
+                if handler is None:
+                    raise JobQueueError(f"No handler for job kind: {job['kind']}")
+                result = await asyncio.wait_for(handler(job["payload"]), timeout=job["visibility_timeout"])
+            except asyncio.CancelledError:
+                await self.queue.fail(job, "Worker shut down")
+                raise
+            except Exception as e:
+                self.failed_total += 1
+                await self.queue.fail(job, f"{type(e).__name__}: {str(e)}")
+            else:
+                self.completed_total += 1
+                await self.queue.complete(job, result)
+
+    async def _reap(self):
+        while not self._stopping:
+            for queue_name in self.concurrency:
+                try:
+                    await self.queue.requeue_expired(queue_name)
+                except Exception as e:
+                    print(f"Error requeueing expired jobs on {queue_name}: {str(e)}")
+            await asyncio.sleep(self.reap_interval)
+
+    def start(self):
+        for queue_name, slots in self.concurrency.items():
+            for _ in range(slots):
+                self._tasks.append(asyncio.ensure_future(self._run_slot(queue_name)))
+        self._tasks.append(asyncio.ensure_future(self._reap()))
+
+    async def run(self):
+        """Run until cancelled"""
+        self.start()
+        try:
+            await asyncio.gather(*self._tasks)
+        finally:
+            await self.stop()
+
+    async def stop(self):
+        self._stopping = True
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "worker_id": self.worker_id,
+            "concurrency": self.concurrency,
+            "completed_total": self.completed_total,
+            "failed_total": self.failed_total
+        }
@@ -0,0 +1,387 @@
+import glob
+import json
+import os
+import struct
+from typing import Any, Callable, Dict, List, Optional, Tuple, Type
+
+import torch
+from transformers import AutoConfig, AutoModelForCausalLM, AutoTokenizer
+
+DTYPES = {
+    "float32": torch.float32,
+    "float16": torch.float16,
+    "bfloat16": torch.bfloat16
+}
+
+SAFETENSORS_DTYPES = {
+    "F64": torch.float64,
+    "F32": torch.float32,
+    "F16": torch.float16,
+    "BF16": torch.bfloat16,
+    "I64": torch.int64,
+    "I32": torch.int32,
+    "I16": torch.int16,
+    "I8": torch.int8,
+    "U8": torch.uint8,
+    "BOOL": torch.bool
+}
+
+# Called with a loading stage name and overall progress between 0 and 1
+ProgressCallback = Callable[[str, float], None]
+
+def read_safetensors_header(path: str) -> Tuple[Dict[str, Any], int]:
+    """
+    Parse a safetensors header without reading any tensor data
+
+    Returns:
+        Tuple of the header dict and the file offset where tensor data starts
+    """
+    with open(path, "rb") as f:
+        (length,) = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(length))
+    return header, 8 + length
+
+
+def mmap_safetensors(path: str) -> Dict[str, torch.Tensor]:
+    """
+    Map a safetensors file and return tensors that are views into the mapping
+
+    The file is mapped privately (copy-on-write), so pages stay in the shared
+    page cache and every process mapping the same file reuses them.
+    """
+    header, data_start = read_safetensors_header(path)
+    storage = torch.UntypedStorage.from_file(path, shared=False, nbytes=os.path.getsize(path))
+    tensors = {}
+    for name, info in header.items():
+        if name == "__metadata__":
+            continue
+        dtype = SAFETENSORS_DTYPES[info["dtype"]]
+        begin, _ = info["data_offsets"]
+        offset = data_start + begin
+        itemsize = torch.empty((), dtype=dtype).element_size()
+        if offset % itemsize:
+            raise ValueError(f"Tensor {name} in {path} is not aligned for zero-copy mapping")
+        tensors[name] = torch.empty(0, dtype=dtype).set_(storage, offset // itemsize, info["shape"])
+    return tensors
+
+
+def resolve_safetensors_files(model_name: str, cache_dir: Optional[str] = None) -> List[str]:
+    """Local safetensors shards for a model directory or Hub id"""
+    if os.path.isdir(model_name):
+        directory = model_name
+    else:
+        from huggingface_hub import snapshot_download
+        directory = snapshot_download(model_name, cache_dir=cache_dir, allow_patterns=["*.json", "*.safetensors"])
+    files = sorted(glob.glob(os.path.join(directory, "*.safetensors")))
+    if not files:
+        raise FileNotFoundError(f"No safetensors weights found for {model_name}")
+    return files
+
+
+def cpu_supports_bf16() -> bool:
+    """Whether this CPU has native bf16 matmuls (AVX512-BF16 or AMX)"""
+    check = getattr(torch.backends.cpu, "get_cpu_capability", None)
+    if check is not None and check() in ("AVX512", "AMX"):
+        return bool(getattr(torch._C._cpu, "_is_avx512_bf16_supported", lambda: False)())
+    return False
+
+
+class ModelBackend:
+    """
+    Loads the model and tokenizer that LLMService generates with
+
+    Subclasses decide device placement, dtype and quantization. They are
+    registered in ``BACKENDS`` and picked with ``LLM_BACKEND``.
+    """
+
+    name = "base"
+
+    def __init__(self, model_name: str, dtype: str = "auto", quantization: Optional[str] = None,
+                 cache_dir: Optional[str] = None, mmap_weights: bool = False):
+        self.model_name = model_name
+        self.dtype = dtype
+        self.quantization = quantization
+        self.cache_dir = cache_dir
+        self.mmap_weights = mmap_weights
+        # Parameter dtype of the loaded model, which mmapped weights keep from the checkpoint
+        self.loaded_dtype: Optional[torch.dtype] = None
+
+    @property
+    def device(self) -> str:
+        return "cpu"
+
+    def resolve_dtype(self) -> torch.dtype:
+        if self.dtype == "auto":
+            return torch.float32
+        if self.dtype not in DTYPES:
+            raise ValueError(f"Unsupported LLM_DTYPE '{self.dtype}', expected auto or one of {', '.join(DTYPES)}")
+        return DTYPES[self.dtype]
+
+    def load_tokenizer(self):
+        return AutoTokenizer.from_pretrained(self.model_name, cache_dir=self.cache_dir)
+
+    def load_model(self, progress: ProgressCallback):
+        raise NotImplementedError
+
+    def load_model_mmap(self, progress: ProgressCallback):
+        """
+        Build the model with its parameters backed by mmapped safetensors files
+
+        Weights keep the dtype they were saved in, since converting them would
+        copy every tensor out of the shared mapping. An fp16 checkpoint
+        therefore runs in fp16 on CPU, which is emulated and much slower than
+        bf16 or float32; ``describe`` reports the dtype actually loaded.
+        """
+        from accelerate import init_empty_weights
+
+        files = resolve_safetensors_files(self.model_name, self.cache_dir)
+        config = AutoConfig.from_pretrained(self.model_name, cache_dir=self.cache_dir)
+        # Parameters start on the meta device and are replaced by the mapped tensors
+        with init_empty_weights():
+            model = AutoModelForCausalLM.from_config(config)
+
+        for i, path in enumerate(files):
+            model.load_state_dict(mmap_safetensors(path), strict=False, assign=True)
+            progress("loading_weights", 0.1 + 0.8 * (i + 1) / len(files))
+        model.tie_weights()
+
+        missing = [name for name, param in model.named_parameters() if param.is_meta]
+        if missing:
+            raise ValueError(f"Weights missing from checkpoint: {', '.join(missing[:5])}")
+        mapped_dtype = next(model.parameters()).dtype
+        if mapped_dtype != self.resolve_dtype():
+            print(f"Mapped weights are {str(mapped_dtype).replace('torch.', '')}, not the configured "
+                  f"{str(self.resolve_dtype()).replace('torch.', '')}; disable LLM_MMAP_WEIGHTS to convert them")
+        return model
+
+    def load(self, progress: Optional[ProgressCallback] = None) -> Tuple[Any, Any]:
+        """Load and return ``(model, tokenizer)``, reporting each stage to ``progress``"""
+        progress = progress or (lambda stage, fraction: None)
+        progress("loading_tokenizer", 0.05)
+        tokenizer = self.load_tokenizer()
+        progress("loading_weights", 0.1)
+        model = self.load_model(progress)
+        model.eval()
+        self.loaded_dtype = next(model.parameters()).dtype
+        return model, tokenizer
+
+    def load_draft_model(self, model_name: str):
+        """
+        Small model for assisted generation; it must share the main model's tokenizer
+
+        Loaded unquantized in the main model's dtype, on the same device.
+        """
+        model = AutoModelForCausalLM.from_pretrained(
+            model_name,
+            torch_dtype=self.resolve_dtype(),
+            low_cpu_mem_usage=True,
+            cache_dir=self.cache_dir
+        )
+        return model.to(self.device).eval()
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "backend": self.name,
+            "model_name": self.model_name,
+            "device": self.device,
+            "dtype": str(self.loaded_dtype or self.resolve_dtype()).replace("torch.", ""),
+            "quantization": self.quantization
+        }
+
+
+class TransformersBackend(ModelBackend):
+    """fp16 weights placed by accelerate's ``device_map="auto"``; intended for GPU nodes"""
+
+    name = "transformers"
+
+    @property
+    def device(self) -> str:
+        return "cuda" if torch.cuda.is_available() else "cpu"
+
+    def resolve_dtype(self) -> torch.dtype:
+        if self.dtype == "auto":
+            # Half precision on CPU is emulated and far slower than float32
+            return torch.float16 if torch.cuda.is_available() else torch.float32
+        return super().resolve_dtype()
+
+    def load_model(self, progress: ProgressCallback):
+        if self.quantization:
+            raise ValueError("LLM_QUANTIZATION is only supported by the cpu backend")
+        return AutoModelForCausalLM.from_pretrained(
+            self.model_name,
+            torch_dtype=self.resolve_dtype(),
+            device_map="auto",
+            cache_dir=self.cache_dir
+        )
+
+
+class CPUBackend(ModelBackend):
+    """
+    CPU-only inference with optional weight quantization
+
+    ``int8`` applies dynamic int8 quantization to every Linear layer, which
+    needs float32 weights. ``int4`` loads 4-bit weights through bitsandbytes.
+    Without quantization, bf16 is used when the CPU supports it natively.
+    """
+
+    name = "cpu"
+    QUANTIZATIONS = ("int8", "int4")
+
+    def __init__(self, model_name: str, dtype: str = "auto", quantization: Optional[str] = None,
+                 cache_dir: Optional[str] = None, mmap_weights: bool = False, num_threads: Optional[int] = None):
+        super().__init__(model_name, dtype, quantization, cache_dir, mmap_weights)
+        if quantization and quantization not in self.QUANTIZATIONS:
+            raise ValueError(f"Unsupported LLM_QUANTIZATION '{quantization}', expected one of {', '.join(self.QUANTIZATIONS)}")
+        self.num_threads = num_threads
+
+    def resolve_dtype(self) -> torch.dtype:
+        if self.quantization == "int8":
+            return torch.float32
+        if self.dtype == "auto":
+            return torch.bfloat16 if cpu_supports_bf16() else torch.float32
+        return super().resolve_dtype()
+
+    def load_model(self, progress: ProgressCallback):
+        if self.num_threads:
+            torch.set_num_threads(self.num_threads)
+
+        if self.mmap_weights and not self.quantization:
+            try:
+                return self.load_model_mmap(progress)
+            except Exception as e:
+                print(f"Error mapping weights, loading a private copy instead: {str(e)}")
+
+        if self.quantization == "int4":
+            try:
+                from transformers import BitsAndBytesConfig
+                import bitsandbytes  # noqa: F401
+            except ImportError as e:
+                raise RuntimeError("LLM_QUANTIZATION=int4 requires the bitsandbytes package") from e
+            return AutoModelForCausalLM.from_pretrained(
+                self.model_name,
+                quantization_config=BitsAndBytesConfig(
+                    load_in_4bit=True,
+                    bnb_4bit_compute_dtype=self.resolve_dtype()
+                ),
+                device_map="cpu",
+                cache_dir=self.cache_dir
+            )
+
+        model = AutoModelForCausalLM.from_pretrained(
+            self.model_name,
+            torch_dtype=self.resolve_dtype(),
+            low_cpu_mem_usage=True,
+            cache_dir=self.cache_dir
+        )
+        if self.quantization == "int8":
+            progress("quantizing", 0.9)
+            model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        return model
+
+    def describe(self) -> Dict[str, Any]:
+        info = super().describe()
+        info["num_threads"] = torch.get_num_threads()
+        info["mmap_weights"] = self.mmap_weights and not self.quantization
+        return info
+
+
+class StubBackend(ModelBackend):
+    """
+    Tiny randomly initialised Llama with a byte-level tokenizer, built in memory
+
+    Needs no downloads or weights, so benchmarks and CI can run the full
+    generation path offline. Weights come from a fixed seed and random text
+    rarely hits a stop sequence, so every request costs the same number of
+    decode steps from run to run.
+    """
+
+    name = "stub"
+    SPECIAL_TOKENS = ("<s>", "</s>", "<unk>")
+
+    def __init__(self, model_name: str = "stub", dtype: str = "auto", quantization: Optional[str] = None,
+                 cache_dir: Optional[str] = None, mmap_weights: bool = False, seed: int = 0,
+                 hidden_size: int = 64, num_layers: int = 2):
+        super().__init__("stub", dtype, None, None, False)
+        self.seed = seed
+        self.hidden_size = hidden_size
+        self.num_layers = num_layers
+
+    def load_tokenizer(self):
+        from tokenizers import Tokenizer, decoders, models, pre_tokenizers
+        from transformers import PreTrainedTokenizerFast
+
+        # One token per byte: no merges, so any text round-trips exactly
+        tokens = list(self.SPECIAL_TOKENS) + sorted(pre_tokenizers.ByteLevel.alphabet())
+        tokenizer = Tokenizer(models.BPE(vocab={token: i for i, token in enumerate(tokens)}, merges=[], unk_token="<unk>"))
+        tokenizer.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+        tokenizer.decoder = decoders.ByteLevel()
+        return PreTrainedTokenizerFast(tokenizer_object=tokenizer, bos_token="<s>", eos_token="</s>", unk_token="<unk>")
+
+    def load_model(self, progress: ProgressCallback):
+        return self._build_model(self.num_layers)
+
+    def load_draft_model(self, model_name: str):
+        # Same seed with a single layer: cheaper than the main model and repeatable across runs
+        return self._build_model(1).eval()
+
+    def _build_model(self, num_layers: int):
+        from transformers import LlamaConfig, LlamaForCausalLM
+
+        config = LlamaConfig(
+            vocab_size=len(self.SPECIAL_TOKENS) + 256,
+            hidden_size=self.hidden_size,
+            intermediate_size=self.hidden_size * 2,
+            num_hidden_layers=num_layers,
+            num_attention_heads=4,
+            num_key_value_heads=4,
+            max_position_embeddings=4096,
+            bos_token_id=0,
+            eos_token_id=1
+        )
+        with torch.random.fork_rng():
+            torch.manual_seed(self.seed)
+            model = LlamaForCausalLM(config)
+        return model.to(self.resolve_dtype())
+
+    def describe(self) -> Dict[str, Any]:
+        info = super().describe()
+        info["seed"] = self.seed
+        return info
+
+
+BACKENDS: Dict[str, Type[ModelBackend]] = {
+    TransformersBackend.name: TransformersBackend,
+    CPUBackend.name: CPUBackend,
+    StubBackend.name: StubBackend
+}
+
+def register_backend(backend_class: Type[ModelBackend]):
+    """Make a backend selectable through ``LLM_BACKEND``"""
+    BACKENDS[backend_class.name] = backend_class
+
+
+def backend_from_env() -> ModelBackend:
+    """
+    Build the backend configured by the environment
+
+    ``LLM_BACKEND`` is one of the registered names, or ``auto`` to use the
+    transformers backend on GPU nodes and the cpu backend elsewhere.
+    """
+    name = os.getenv("LLM_BACKEND", "auto").lower()
+    if name == "auto":
+        name = TransformersBackend.name if torch.cuda.is_available() else CPUBackend.name
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown LLM_BACKEND '{name}', expected auto or one of {', '.join(BACKENDS)}")
+
+    kwargs = {
+        "model_name": os.getenv("MODEL_NAME", "meta-llama/Llama-2-7b-hf"),
+        "dtype": os.getenv("LLM_DTYPE", "auto").lower(),
+        "quantization": os.getenv("LLM_QUANTIZATION", "").lower() or None,
+        "cache_dir": os.getenv("MODEL_CACHE_DIR") or None,
+        "mmap_weights": os.getenv("LLM_MMAP_WEIGHTS", "false").lower() == "true"
+    }
+    if name == CPUBackend.name:
+        kwargs["num_threads"] = int(os.getenv("TORCH_NUM_THREADS", "0")) or None
+    if name == StubBackend.name:
+        kwargs["seed"] = int(os.getenv("LLM_STUB_SEED", "0"))
+    return BACKENDS[name](**kwargs)
@@ -1,126 +1,660 @@
-from transformers import AutoModelForCausalLM, AutoTokenizer
+from transformers import DynamicCache, StoppingCriteria, StoppingCriteriaList, TextStreamer
 import torch
-from typing import List, Dict, Any
+from typing import List, Dict, Any, AsyncIterator, Callable, Optional, Tuple
 import asyncio
+import concurrent.futures
+import os
+import re
+import threading
+import time
+
+from app.services.batch_scheduler import MicroBatcher
+from app.services.inference_executor import InferenceExecutor, InferenceJob, InferenceQueueFull
+from app.services.llm_backends import backend_from_env
+from app.services.metrics import (
+    LLM_DRAFT_ACCEPTANCE_RATE, LLM_DRAFT_TOKENS, LLM_GENERATED_TOKENS, LLM_STAGE_SECONDS, LLM_TOKENS_PER_SECOND
+)
+from app.services.prefix_cache import PrefixCache, crop_to
+from app.services.prompt_utils import normalize_code, trim_at_stop_sequences, truncate_code
+from app.services.result_cache import ResultCache, cache_from_env
+
+# Section marker for the combined explanation + suggestions prompt
+SUGGESTIONS_HEADER = "Suggestions:"
+SUGGESTIONS_SECTION = re.compile(r"^\s*suggestions:\s*", re.IGNORECASE | re.MULTILINE)
+SUGGESTION_BULLET = re.compile(r"^\s*(?:[-*\u2022]|\d+[.)])\s*")
+MAX_PARSED_SUGGESTIONS = 3
+# Suggestions returned per editor update
+NUM_SUGGESTIONS = 3
+
+# Text that means the model has finished its answer and started rambling
+STOP_SEQUENCES = {
+    "suggestion": ["\n\n\n", "Given this Python code:"],
+    "explanation": ["\n\n\n\n", "Explain what this code does"]
+}
+# Room left in the context for the prompt template around the code
+PROMPT_TEMPLATE_TOKENS = 96
+
+class JobStoppingCriteria(StoppingCriteria):
+    """
+    Ends generation early once the request is cancelled or past its deadline
+
+    The job records which one stopped it, and the executor fails a run cut
+    short by its deadline, so truncated text is never returned or cached.
+    """
+
+    def __init__(self, job: InferenceJob):
+        self.job = job
+
+    def __call__(self, input_ids, scores, **kwargs) -> bool:
+        return self.job.should_stop()
+
+class GenerationTimer(StoppingCriteria):
+    """
+    Never stops generation; notes when each token step completes
+
+    Stopping criteria run once per decode step, so the first call marks the
+    end of prefill (the prompt forward pass plus the first token).
+    """
+
+    def __init__(self):
+        self.first_token_at: Optional[float] = None
+        self.first_step_length = 0
+
+    def __call__(self, input_ids, scores, **kwargs) -> bool:
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+            self.first_step_length = input_ids.shape[1]
+        return False
+
+class StopSequenceCriteria(StoppingCriteria):
+    """Stops each sequence once its generated text contains a stop sequence"""
+
+    def __init__(self, tokenizer, stop_sequences: List[str], prompt_length: int, window: int = 16):
+        self.tokenizer = tokenizer
+        self.stop_sequences = stop_sequences
+        self.prompt_length = prompt_length
+        # Only the newest tokens are decoded, enough to span any stop sequence
+        self.window = window
+
+    def __call__(self, input_ids, scores, **kwargs) -> torch.BoolTensor:
+        done = []
+        for row in input_ids:
+            tail = self.tokenizer.decode(row[self.prompt_length:][-self.window:], skip_special_tokens=True)
+            done.append(any(stop in tail for stop in self.stop_sequences))
+        return torch.tensor(done, dtype=torch.bool, device=input_ids.device)
+
+class AsyncTextStreamer(TextStreamer):
+    """Hands decoded text from the inference thread to an asyncio queue"""
+
+    def __init__(self, tokenizer, loop: asyncio.AbstractEventLoop, **decode_kwargs):
+        super().__init__(tokenizer, skip_prompt=True, **decode_kwargs)
+        self.loop = loop
+        self.queue: asyncio.Queue = asyncio.Queue()
+
+    def on_finalized_text(self, text: str, stream_end: bool = False):
+        if text:
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, text)
 
 class LLMService:
     def __init__(self):
+        self.backend = None
         self.model = None
         self.tokenizer = None
+        # Background model loading, reported by get_load_state
+        self.load_state = {"stage": "not_started", "progress": 0.0, "error": None}
+        self._load_future: Optional[concurrent.futures.Future] = None
+        self._load_lock = threading.Lock()
+        self._load_started_at: Optional[float] = None
+        self._load_time = 0.0
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
-        self.max_length = 2048
+        self.max_length = int(os.getenv("MAX_MODEL_LENGTH", "2048"))
+        # Output budgets per endpoint; the prompt is truncated to fit beside them
+        self.max_new_tokens = {
+            "suggestion": int(os.getenv("SUGGESTION_MAX_NEW_TOKENS", "128")),
+            "explanation": int(os.getenv("EXPLANATION_MAX_NEW_TOKENS", "512"))
+        }
+        self.max_prompt_tokens = int(os.getenv("LLM_MAX_PROMPT_TOKENS", "1024"))
         self.initialized = False
+        # Generation runs on a dedicated thread so it never blocks the event loop
+        self.inference = InferenceExecutor()
+        self.suggestion_timeout = float(os.getenv("LLM_SUGGESTION_TIMEOUT", "30"))
+        self.explanation_timeout = float(os.getenv("LLM_EXPLANATION_TIMEOUT", "120"))
+        # Suggestion requests arriving within a few milliseconds share one generate call
+        self.suggestion_batcher = MicroBatcher(self._run_suggestion_batch)
+        # Suggestions recently sent over the WebSocket, reused by /explain
+        self.recent_suggestions = cache_from_env("suggestions", "SUGGESTION")
+        # Explanations keyed on AST-normalized code, shared through Redis when configured
+        self.explanation_cache_enabled = os.getenv("EXPLANATION_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+        self.explanation_cache = cache_from_env("explain", "EXPLANATION", cost_field="generation_time")
+        # Opt-in per-session KV reuse for consecutive editor updates
+        self.prefix_cache = PrefixCache() if os.getenv("LLM_PREFIX_CACHE", "false").lower() == "true" else None
+        # Assisted generation: a small draft model proposes tokens that the main
+        # model verifies in one forward pass, for the kinds in SPECULATIVE_ENDPOINTS
+        self.draft_model_name = os.getenv("DRAFT_MODEL_NAME", "")
+        self.draft_model = None
+        self.draft_num_tokens = int(os.getenv("DRAFT_NUM_TOKENS", "5"))
+        self.speculative_kinds = {
+            kind.strip() for kind in os.getenv("SPECULATIVE_ENDPOINTS", "suggestion").split(",") if kind.strip()
+        }
+        # Forward passes per model, counted by hooks to derive draft acceptance
+        self._forward_calls = {"main": 0, "draft": 0}
+
+    def start_loading(self) -> concurrent.futures.Future:
+        """
+        Begin loading the model on a background thread
+
+        Returns:
+            Future resolving to True once the model is ready, or False if loading failed
+        """
+        with self._load_lock:
+            failed = self._load_future is not None and self._load_future.done() and not self._load_future.result()
+            if self._load_future is None or failed:
+                self._load_future = concurrent.futures.Future()
+                self.load_state = {"stage": "starting", "progress": 0.0, "error": None}
+                self._load_started_at = time.monotonic()
+                threading.Thread(target=self._load_model, name="model-loader", daemon=True).start()
+            return self._load_future
+
+    def _set_load_stage(self, stage: str, progress: float):
+        self.load_state = {"stage": stage, "progress": round(progress, 3), "error": None}
+
+    def _load_model(self):
+        """Blocking model load; runs on the loader thread"""
+        try:
+            # Model, dtype and quantization come from the configured backend
+            self.backend = backend_from_env()
+            model, tokenizer = self.backend.load(self._set_load_stage)
+            # Batched prompts are left-padded so generation continues right after each prompt
+            tokenizer.padding_side = "left"
+            if tokenizer.pad_token is None:
+                tokenizer.pad_token = tokenizer.eos_token
+            self.model, self.tokenizer = model, tokenizer
+            self.device = self.backend.device
+            if self.draft_model_name:
+                self._set_load_stage("loading_draft", 0.95)
+                self.draft_model = self._load_draft_model()
+            self.initialized = True
+            self._load_time = time.monotonic() - self._load_started_at
+            self._set_load_stage("ready", 1.0)
+            print(f"Loaded LLM in {self._load_time:.1f}s: {self.backend.describe()}")
+        except Exception as e:
+            print(f"Error initializing LLM: {str(e)}")
+            self.load_state = {"stage": "failed", "progress": self.load_state["progress"], "error": str(e)}
+        self._load_future.set_result(self.initialized)
+
+    def _count_forward(self, name: str):
+        def hook(module, inputs, output):
+            self._forward_calls[name] += 1
+        return hook
+
+    def _load_draft_model(self):
+        """Load the draft model; on failure generation carries on without it"""
+        try:
+            draft = self.backend.load_draft_model(self.draft_model_name)
+            draft.generation_config.num_assistant_tokens = self.draft_num_tokens
+        except Exception as e:
+            print(f"Error loading draft model, speculative decoding disabled: {str(e)}")
+            return None
+        draft.register_forward_hook(self._count_forward("draft"))
+        self.model.register_forward_hook(self._count_forward("main"))
+        return draft
+
+    def speculative(self, kind: str) -> bool:
+        """Whether generation for ``kind`` uses the draft model"""
+        return self.draft_model is not None and kind in self.speculative_kinds
 
     async def initialize(self):
-        """Initialize the LLM model and tokenizer"""
-        if not self.initialized:
+        """Initialize the LLM model and tokenizer, waiting for a load already in progress"""
+        if self.initialized:
+            return True
+        # Shielded so a cancelled request doesn't cancel the shared load
+        return await asyncio.shield(asyncio.wrap_future(self.start_loading()))
+
+    def get_load_state(self) -> Dict[str, Any]:
+        """Loading stage and progress, for readiness checks"""
+        state = dict(self.load_state, ready=self.initialized)
+        if self._load_started_at is not None:
+            state["elapsed"] = self._load_time if self.initialized else time.monotonic() - self._load_started_at
+        if self.backend is not None:
+            state["model"] = self.backend.describe()
+        if self.draft_model is not None:
+            state["draft_model"] = {"model_name": self.draft_model_name, "endpoints": sorted(self.speculative_kinds)}
+        return state
+
+    def _fit_code(self, code: str, kind: str, cursor_line: Optional[int] = None) -> str:
+        """Truncate code around the cursor so prompt and output fit the context"""
+        budget = min(
+            self.max_prompt_tokens,
+            self.max_length - self.max_new_tokens[kind] - PROMPT_TEMPLATE_TOKENS
+        )
+        return truncate_code(
+            code,
+            max(budget, 1),
+            lambda lines: [len(ids) for ids in self.tokenizer(lines, add_special_tokens=False)["input_ids"]],
+            cursor_line
+        )
+
+    def _generation_kwargs(self, kind: str, job: InferenceJob, prompt_length: int, **overrides) -> Dict[str, Any]:
+        """Sampling settings, output budget and stopping rules shared by every generate call"""
+        kwargs = {
+            "max_new_tokens": self.max_new_tokens[kind],
+            "temperature": 0.7,
+            "top_p": 0.95,
+            "do_sample": True,
+            "pad_token_id": self.tokenizer.pad_token_id,
+            "stopping_criteria": StoppingCriteriaList([
+                JobStoppingCriteria(job),
+                StopSequenceCriteria(self.tokenizer, STOP_SEQUENCES[kind], prompt_length)
+            ])
+        }
+        kwargs.update(overrides)
+        # Assisted generation verifies a single sequence at a time
+        if self.speculative(kind) and kwargs.get("num_return_sequences", 1) == 1:
+            kwargs["assistant_model"] = self.draft_model
+        return kwargs
+
+    def _generate(self, kind: str, started: Optional[float] = None, **kwargs):
+        """
+        ``model.generate`` that records prefill and decode time and decode throughput
+
+        Args:
+            kind (str): "suggestion" or "explanation"
+            started (float, optional): perf_counter value prefill began at, when
+                part of the prompt was encoded before this call
+        """
+        timer = GenerationTimer()
+        kwargs["stopping_criteria"].append(timer)
+        forward_calls = dict(self._forward_calls)
+        started = started if started is not None else time.perf_counter()
+        outputs = self.model.generate(**kwargs)
+        finished = time.perf_counter()
+
+        if timer.first_token_at is not None:
+            rows = outputs.shape[0]
+            new_tokens = outputs.shape[1] - kwargs["input_ids"].shape[1]
+            decode_tokens = outputs.shape[1] - timer.first_step_length
+            decode_time = finished - timer.first_token_at
+            LLM_STAGE_SECONDS.observe(timer.first_token_at - started, kind=kind, stage="prefill")
+            LLM_STAGE_SECONDS.observe(decode_time, kind=kind, stage="decode")
+            LLM_GENERATED_TOKENS.inc(new_tokens * rows, kind=kind)
+            if decode_tokens > 0 and decode_time > 0:
+                LLM_TOKENS_PER_SECOND.observe(decode_tokens * rows / decode_time, kind=kind)
+
+        if "assistant_model" in kwargs:
+            # Each main forward pass verifies one batch of drafts and adds one token of its
+            # own, so every other new token was an accepted draft token
+            verify_passes = self._forward_calls["main"] - forward_calls["main"]
+            proposed = self._forward_calls["draft"] - forward_calls["draft"]
+            accepted = max(0, outputs.shape[1] - kwargs["input_ids"].shape[1] - verify_passes)
+            LLM_DRAFT_TOKENS.inc(proposed, kind=kind, outcome="proposed")
+            LLM_DRAFT_TOKENS.inc(accepted, kind=kind, outcome="accepted")
+            if proposed:
+                LLM_DRAFT_ACCEPTANCE_RATE.observe(min(1.0, accepted / proposed), kind=kind)
+        return outputs
+
+    def _decode(self, output, prompt_length: int, kind: str) -> str:
+        """Decode only the generated tokens, cut at the first stop sequence"""
+        text = self.tokenizer.decode(output[prompt_length:], skip_special_tokens=True)
+        return trim_at_stop_sequences(text, STOP_SEQUENCES[kind]).strip()
+
+    def _suggestion_prompt(self, code: str, cursor_line: Optional[int] = None) -> str:
+        return f"""Given this Python code:
+            {self._fit_code(code, "suggestion", cursor_line)}
+
+            Suggest improvements or completions for this code:"""
+
+    def _generate_suggestions_sync(self, requests: List[Tuple[str, Optional[int]]],
+                                   job: InferenceJob) -> List[List[str]]:
+        """Blocking batched suggestion generation; runs on the inference thread"""
+        num_return_sequences = NUM_SUGGESTIONS
+        with LLM_STAGE_SECONDS.time(kind="suggestion", stage="tokenize"):
+            prompts = [self._suggestion_prompt(code, cursor_line) for code, cursor_line in requests]
+            inputs = self.tokenizer(prompts, return_tensors="pt", padding=True).to(self.device)
+        # Every row starts with the same padded prompt width, so only decode what follows it
+        prompt_length = inputs["input_ids"].shape[1]
+
+        with torch.no_grad():
+            outputs = self._generate(
+                "suggestion",
+                **inputs,
+                **self._generation_kwargs("suggestion", job, prompt_length,
+                                          num_return_sequences=num_return_sequences)
+            )
+
+        suggestions = [self._decode(output, prompt_length, "suggestion") for output in outputs]
+
+        # Outputs are grouped per prompt, num_return_sequences rows each
+        return [
+            suggestions[i:i + num_return_sequences]
+            for i in range(0, len(suggestions), num_return_sequences)
+        ]
+
+    def _generate_suggestions_prefixed_sync(self, code: str, cursor_line: Optional[int], session_id: str,
+                                            job: InferenceJob) -> List[str]:
+        """Blocking suggestion generation reusing the session's prompt KV cache; runs on the inference thread"""
+        num_return_sequences = NUM_SUGGESTIONS
+        with LLM_STAGE_SECONDS.time(kind="suggestion", stage="tokenize"):
+            prompt = self._suggestion_prompt(code, cursor_line)
+            input_ids = self.tokenizer(prompt, return_tensors="pt")["input_ids"].to(self.device)
+        prompt_ids = input_ids[0].tolist()
+        # The cache covers every prompt token except the last, which generate feeds itself
+        prefix_length = len(prompt_ids) - 1
+
+        past_key_values, reused = self.prefix_cache.take(session_id, prompt_ids)
+        if past_key_values is None:
+            past_key_values = DynamicCache()
+
+        with torch.no_grad():
+            # Encoding the uncached tail counts as part of prefill
+            started = time.perf_counter()
+            if reused < prefix_length:
+                # Only the tail after the common prefix is encoded
+                self.model(input_ids=input_ids[:, reused:prefix_length], past_key_values=past_key_values, use_cache=True)
+            self.prefix_cache.record(reused, len(prompt_ids) - reused)
+
+            past_key_values.batch_repeat_interleave(num_return_sequences)
             try:
-                # Load Llama model and tokenizer
-                model_name = "meta-llama/Llama-2-7b-hf"  # You'll need appropriate credentials
-                self.tokenizer = AutoTokenizer.from_pretrained(model_name)
-                self.model = AutoModelForCausalLM.from_pretrained(
-                    model_name,
-                    torch_dtype=torch.float16,
-                    device_map="auto"
+                outputs = self._generate(
+                    "suggestion",
+                    started,
+                    input_ids=input_ids,
+                    attention_mask=torch.ones_like(input_ids),
+                    past_key_values=past_key_values,
+                    **self._generation_kwargs("suggestion", job, len(prompt_ids),
+                                              num_return_sequences=num_return_sequences)
                 )
-                self.initialized = True
-                return True
-            except Exception as e:
-                print(f"Error initializing LLM: {str(e)}")
-                return False
+            finally:
+                # Generation extended the cache in place; trim it back to the prompt for the next update
+                crop_to(past_key_values, prefix_length)
+                past_key_values.batch_select_indices(torch.tensor([0], device=input_ids.device))
+                self.prefix_cache.put(session_id, prompt_ids[:prefix_length], past_key_values)
+
+        return [self._decode(output, len(prompt_ids), "suggestion") for output in outputs]
+
+    async def _run_suggestion_batch(self, requests: List[Tuple[str, Optional[int]]]) -> List[List[str]]:
+        return await self.inference.run(
+            lambda job: self._generate_suggestions_sync(requests, job),
+            timeout=self.suggestion_timeout
+        )
+
+    def _single_suggestion_sync(self, code: str, cursor_line: Optional[int], job: InferenceJob,
+                                streamer: Optional[TextStreamer] = None) -> str:
+        """Blocking generation of one suggestion, optionally fed to ``streamer``; runs on the inference thread"""
+        with LLM_STAGE_SECONDS.time(kind="suggestion", stage="tokenize"):
+            inputs = self.tokenizer(self._suggestion_prompt(code, cursor_line), return_tensors="pt").to(self.device)
+        prompt_length = inputs["input_ids"].shape[1]
+
+        with torch.no_grad():
+            outputs = self._generate(
+                "suggestion",
+                **inputs,
+                **self._generation_kwargs("suggestion", job, prompt_length, streamer=streamer)
+            )
+
+        return self._decode(outputs[0], prompt_length, "suggestion")
+
+    def _speculative_suggestions_sync(self, code: str, cursor_line: Optional[int], job: InferenceJob) -> List[str]:
+        """
+        Blocking assisted generation of NUM_SUGGESTIONS suggestions, one after
+        another since assisted generation verifies a single sequence at a time;
+        runs on the inference thread
+        """
+        suggestions = []
+        for _ in range(NUM_SUGGESTIONS):
+            suggestions.append(self._single_suggestion_sync(code, cursor_line, job))
+            if job.should_stop():
+                break
+        return suggestions
+
+    async def _stream_generation(self, fn: Callable[[InferenceJob, TextStreamer], Any],
+                                 timeout: float) -> AsyncIterator[str]:
+        """Run ``fn`` on the inference thread and yield text as it is decoded"""
+        if not self.initialized:
+            await self.initialize()
+
+        streamer = AsyncTextStreamer(self.tokenizer, asyncio.get_running_loop(), skip_special_tokens=True)
+        task = asyncio.ensure_future(self.inference.run(lambda job: fn(job, streamer), timeout=timeout))
+        # Text is queued before the job resolves, so this marker always arrives last
+        task.add_done_callback(lambda _: streamer.queue.put_nowait(None))
+        try:
+            while True:
+                text = await streamer.queue.get()
+                if text is None:
+                    break
+                yield text
+            await task
+        finally:
+            # Consumer stopped early (e.g. client disconnected): stop generating
+            if not task.done():
+                task.cancel()
 
-    async def generate_suggestions(self, code: str) -> List[str]:
+    def stream_suggestion(self, code: str, cursor_line: Optional[int] = None) -> AsyncIterator[str]:
+        """
+        Stream a single suggestion token by token
+
+        Streaming bypasses the suggestion batcher and produces one sequence
+        instead of three, since decoded text can only be streamed for a
+        single sequence at a time.
+
+        Args:
+            code (str): The current code in the editor
+            cursor_line (int, optional): 1-based cursor line used when truncating long code
+
+        Returns:
+            Async iterator of text deltas
+        """
+        return self._stream_generation(
+            lambda job, streamer: self._single_suggestion_sync(code, cursor_line, job, streamer),
+            self.suggestion_timeout
+        )
+
+    def stream_explanation(self, code: str, detail_level: str = "medium", with_suggestions: bool = False,
+                           cursor_line: Optional[int] = None) -> AsyncIterator[str]:
+        """
+        Stream an explanation token by token
+
+        Args:
+            code (str): The code to explain
+            detail_level (str): Level of detail for the explanation
+            with_suggestions (bool): Ask for a Suggestions section in the same
+                generation; pass the joined text to ``parse_explanation``
+            cursor_line (int, optional): 1-based cursor line used when truncating long code
+
+        Returns:
+            Async iterator of text deltas
+        """
+        return self._stream_generation(
+            lambda job, streamer: self._explain_sync(code, detail_level, job, with_suggestions, cursor_line, streamer),
+            self.explanation_timeout
+        )
+
+    async def generate_suggestions(self, code: str, session_id: Optional[str] = None,
+                                   cursor_line: Optional[int] = None) -> List[str]:
         """
         Generate code suggestions based on the current code
-        
+
         Args:
             code (str): The current code in the editor
-            
+            session_id (str, optional): Editor session; with the prefix cache
+                enabled, its previous prompt's KV state is reused
+            cursor_line (int, optional): 1-based cursor line used when truncating long code
+
         Returns:
             List of suggestion strings
+
+        Raises:
+            InferenceQueueFull: If the server is saturated, so callers can report
+                overload instead of an empty list
         """
         if not self.initialized:
             await self.initialize()
 
         try:
-            prompt = f"""Given this Python code:
-            {code}
-            
-            Suggest improvements or completions for this code:"""
-
-            inputs = self.tokenizer(prompt, return_tensors="pt").to(self.device)
-            
-            with torch.no_grad():
-                outputs = self.model.generate(
-                    **inputs,
-                    max_length=self.max_length,
-                    num_return_sequences=3,
-                    temperature=0.7,
-                    top_p=0.95,
-                    do_sample=True
+            if self.speculative("suggestion"):
+                # Assisted generation handles one sequence at a time, so this skips
+                # the batcher and the prefix cache and generates the suggestions in turn
+                suggestions = await self.inference.run(
+                    lambda job: self._speculative_suggestions_sync(code, cursor_line, job),
+                    timeout=self.suggestion_timeout
                 )
+            elif self.prefix_cache is not None and session_id is not None:
+                # Session requests carry their own KV state, so they skip the batcher
+                suggestions = await self.inference.run(
+                    lambda job: self._generate_suggestions_prefixed_sync(code, cursor_line, session_id, job),
+                    timeout=self.suggestion_timeout
+                )
+            else:
+                suggestions = await self.suggestion_batcher.submit((code, cursor_line))
+            # Remembered so an /explain for the same code can reuse them
+            await self.recent_suggestions.set(ResultCache.make_key(code), {"suggestions": suggestions})
+            return suggestions
 
-            suggestions = [
-                self.tokenizer.decode(output, skip_special_tokens=True)
-                for output in outputs
-            ]
-
-            # Process and clean up suggestions
-            cleaned_suggestions = [
-                suggestion.replace(prompt, "").strip()
-                for suggestion in suggestions
-            ]
-
-            return cleaned_suggestions
-
+        except InferenceQueueFull:
+            raise
         except Exception as e:
             print(f"Error generating suggestions: {str(e)}")
             return []
 
-    async def explain_code(self, code: str, detail_level: str = "medium") -> Dict[str, Any]:
+    def end_session(self, session_id: str):
+        """Release per-session state once an editor disconnects"""
+        if self.prefix_cache is not None:
+            self.prefix_cache.drop(session_id)
+
+    async def get_recent_suggestions(self, code: str) -> Optional[List[str]]:
+        """Suggestions recently generated for exactly this code, if any"""
+        cached = await self.recent_suggestions.get(ResultCache.make_key(code))
+        return cached["suggestions"] if cached else None
+
+    def model_version(self) -> str:
+        """Identifies the loaded weights, so cached output is not reused across models"""
+        if self.backend is None:
+            return "unloaded"
+        info = self.backend.describe()
+        return f"{info['model_name']}:{info['dtype']}:{info['quantization'] or 'none'}"
+
+    def explanation_cache_key(self, code: str, detail_level: str, include_suggestions: bool,
+                              cursor_line: Optional[int] = None) -> Optional[str]:
+        """Cache key for an explanation, or None when the explanation cache is disabled"""
+        if not self.explanation_cache_enabled:
+            return None
+        return ResultCache.make_key(
+            "explain", normalize_code(code), detail_level, include_suggestions,
+            cursor_line, self.model_version()
+        )
+
+    def _explain_prompt(self, code: str, detail_level: str, with_suggestions: bool,
+                        cursor_line: Optional[int] = None) -> str:
+        detail_prompts = {
+            "basic": "Briefly explain what this code does:",
+            "medium": "Explain what this code does and how it works:",
+            "detailed": "Provide a detailed explanation of this code, including its purpose, implementation details, and potential improvements:"
+        }
+
+        prompt = f"""{detail_prompts.get(detail_level, detail_prompts["medium"])}
+
+            {self._fit_code(code, "explanation", cursor_line)}"""
+
+        if with_suggestions:
+            # One generation answers both parts instead of a separate suggestions pass
+            prompt += f"""
+
+            Answer with two sections. Under "Explanation:" explain the code.
+            Under "{SUGGESTIONS_HEADER}" list up to {MAX_PARSED_SUGGESTIONS} improvements, one per line starting with "-".
+
+            Explanation:"""
+        return prompt
+
+    @staticmethod
+    def parse_explanation(text: str) -> Dict[str, Any]:
+        """
+        Split a combined generation into its Explanation and Suggestions sections
+
+        Args:
+            text (str): Generated text following the combined explain prompt
+
+        Returns:
+            Dictionary with explanation text and a list of suggestions
+        """
+        parts = SUGGESTIONS_SECTION.split(text, maxsplit=1)
+        explanation = parts[0].strip()
+        suggestions = []
+        if len(parts) > 1:
+            for line in parts[1].splitlines():
+                line = SUGGESTION_BULLET.sub("", line).strip()
+                if line:
+                    suggestions.append(line)
+        return {
+            "explanation": explanation,
+            "suggestions": suggestions[:MAX_PARSED_SUGGESTIONS]
+        }
+
+    def _explain_sync(self, code: str, detail_level: str, job: InferenceJob, with_suggestions: bool = False,
+                      cursor_line: Optional[int] = None, streamer: Optional[TextStreamer] = None) -> str:
+        """Blocking explanation generation; runs on the inference thread"""
+        with LLM_STAGE_SECONDS.time(kind="explanation", stage="tokenize"):
+            prompt = self._explain_prompt(code, detail_level, with_suggestions, cursor_line)
+            inputs = self.tokenizer(prompt, return_tensors="pt").to(self.device)
+        prompt_length = inputs["input_ids"].shape[1]
+
+        with torch.no_grad():
+            outputs = self._generate(
+                "explanation",
+                **inputs,
+                **self._generation_kwargs("explanation", job, prompt_length, streamer=streamer)
+            )
+
+        return self._decode(outputs[0], prompt_length, "explanation")
+
+    async def explain_code(self, code: str, detail_level: str = "medium", include_suggestions: bool = True,
+                           cursor_line: Optional[int] = None) -> Dict[str, Any]:
         """
         Generate explanation for the given code
-        
+
+        Suggestions come from the suggestions recently generated for the same
+        code when available, otherwise from a Suggestions section requested in
+        the same generation as the explanation.
+
         Args:
             code (str): The code to explain
             detail_level (str): Level of detail for the explanation
-            
+            include_suggestions (bool): Whether to return suggestions at all
+            cursor_line (int, optional): 1-based cursor line used when truncating long code
+
         Returns:
             Dictionary containing explanation and any additional insights
+
+        Raises:
+            InferenceQueueFull: If the server is saturated
         """
         if not self.initialized:
             await self.initialize()
 
-        try:
-            detail_prompts = {
-                "basic": "Briefly explain what this code does:",
-                "medium": "Explain what this code does and how it works:",
-                "detailed": "Provide a detailed explanation of this code, including its purpose, implementation details, and potential improvements:"
-            }
-
-            prompt = f"""{detail_prompts.get(detail_level, detail_prompts["medium"])}
-            
-            {code}"""
-
-            inputs = self.tokenizer(prompt, return_tensors="pt").to(self.device)
-            
-            with torch.no_grad():
-                outputs = self.model.generate(
-                    **inputs,
-                    max_length=self.max_length,
-                    temperature=0.7,
-                    top_p=0.95,
-                    do_sample=True
-                )
+        async def generate() -> Dict[str, Any]:
+            started = time.monotonic()
+            suggestions = await self.get_recent_suggestions(code) if include_suggestions else []
+            with_suggestions = suggestions is None
 
-            explanation = self.tokenizer.decode(outputs[0], skip_special_tokens=True)
-            explanation = explanation.replace(prompt, "").strip()
+            text = await self.inference.run(
+                lambda job: self._explain_sync(code, detail_level, job, with_suggestions, cursor_line),
+                timeout=self.explanation_timeout
+            )
 
-            return {
-                "explanation": explanation,
-                "suggestions": await self.generate_suggestions(code)
+            result = self.parse_explanation(text) if with_suggestions else {
+                "explanation": text,
+                "suggestions": suggestions
             }
+            result["generation_time"] = time.monotonic() - started
+            return result
+
+        try:
+            key = self.explanation_cache_key(code, detail_level, include_suggestions, cursor_line)
+            if key is None:
+                return await generate()
+            # Identical concurrent requests share one generation
+            return await self.explanation_cache.get_or_compute(key, generate)
 
+        except InferenceQueueFull:
+            raise
         except Exception as e:
             print(f"Error generating explanation: {str(e)}")
             return {
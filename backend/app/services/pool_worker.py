@@ -0,0 +1,195 @@
+"""
+Warm Python worker used by the execution pool
+
+The worker is started once by WorkerPool and then serves jobs over its
+stdin/stdout pipes. Every job runs in a freshly forked child with a clean
+``__main__`` namespace, so user code never sees state from earlier runs,
+while interpreter startup and site imports are paid only once.
+
+Frames are a 4-byte big-endian length followed by a UTF-8 JSON document.
+This file must only depend on the standard library and sandbox_runner.
+"""
+
+import base64
+import json
+import marshal
+import os
+import selectors
+import signal
+import struct
+import time
+
+from sandbox_runner import apply_resource_limits, compile_submission, format_resource_usage, register_source, run_child
+
+HEADER = struct.Struct(">I")
+READ_CHUNK = 65536
+
+
+def read_frame(stream):
+    header = stream.read(HEADER.size)
+    if len(header) < HEADER.size:
+        return None
+    (length,) = HEADER.unpack(header)
+    payload = b""
+    while len(payload) < length:
+        chunk = stream.read(length - len(payload))
+        if not chunk:
+            return None
+        payload += chunk
+    return json.loads(payload.decode("utf-8"))
+
+
+def write_frame(stream, message):
+    payload = json.dumps(message).encode("utf-8")
+    stream.write(HEADER.pack(len(payload)) + payload)
+    stream.flush()
+
+
+def run_job(job, code, protocol_fds, stdin=None, args=None, cwd=None):
+    """Fork a child for one run of ``code`` and collect its output"""
+    timeout = job.get("timeout") or 30
+    max_output_bytes = job.get("max_output_bytes")
+    out_r, out_w = os.pipe()
+    err_r, err_w = os.pipe()
+    in_r, in_w = os.pipe() if stdin else (None, None)
+    start_time = time.perf_counter()
+
+    pid = os.fork()
+    if pid == 0:
+        # Child: own process group so the worker can kill everything it spawns
+        os.setpgid(0, 0)
+        for fd in (out_r, err_r, in_w) + protocol_fds:
+            if fd is not None:
+                os.close(fd)
+        os.dup2(out_w, 1)
+        os.dup2(err_w, 2)
+        os.close(out_w)
+        os.close(err_w)
+        if in_r is not None:
+            os.dup2(in_r, 0)
+            os.close(in_r)
+        if cwd or job.get("cwd"):
+            os.chdir(cwd or job["cwd"])
+        if job.get("env"):
+            os.environ.update(job["env"])
+        apply_resource_limits(job.get("limits"))
+        os._exit(run_child(code, args))
+
+    os.close(out_w)
+    os.close(err_w)
+    buffers = {out_r: bytearray(), err_r: bytearray()}
+    deadline = start_time + timeout
+    timed_out = False
+    truncated = False
+    pending_input = memoryview(stdin.encode("utf-8")) if stdin else None
+
+    with selectors.DefaultSelector() as selector:
+        for fd in buffers:
+            selector.register(fd, selectors.EVENT_READ)
+        if in_w is not None:
+            os.close(in_r)
+            os.set_blocking(in_w, False)
+            selector.register(in_w, selectors.EVENT_WRITE)
+        while selector.get_map():
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                timed_out = True
+                break
+            for key, _ in selector.select(remaining):
+                if key.fd == in_w:
+                    # Feed stdin as the child consumes it; closing signals EOF
+                    try:
+                        sent = os.write(in_w, pending_input[:READ_CHUNK])
+                        pending_input = pending_input[sent:]
+                    except BrokenPipeError:
+                        pending_input = pending_input[:0]
+                    if not pending_input:
+                        selector.unregister(in_w)
+                        os.close(in_w)
+                        in_w = None
+                    continue
+                chunk = os.read(key.fd, READ_CHUNK)
+                if chunk:
+                    buffers[key.fd] += chunk
+                    if max_output_bytes and len(buffers[key.fd]) > max_output_bytes:
+                        del buffers[key.fd][max_output_bytes:]
+                        truncated = True
+                else:
+                    selector.unregister(key.fd)
+            if truncated:
+                break
+
+    if in_w is not None:
+        os.close(in_w)
+    if timed_out or truncated:
+        try:
+            os.killpg(pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+    _, wait_status, rusage = os.wait4(pid, 0)
+    execution_time = time.perf_counter() - start_time
+    os.close(out_r)
+    os.close(err_r)
+
+    return {
+        "returncode": os.waitstatus_to_exitcode(wait_status),
+        "timed_out": timed_out,
+        "truncated": truncated,
+        "stdout": buffers[out_r].decode("utf-8", errors="replace"),
+        "stderr": buffers[err_r].decode("utf-8", errors="replace"),
+        "execution_time": execution_time,
+        "resource_usage": format_resource_usage(rusage),
+    }
+
+
+def load_code(job):
+    """The code object precompiled by the API when one was sent, otherwise the source"""
+    if not job.get("bytecode"):
+        return job["code"]
+    # Tracebacks still quote source lines; children inherit the linecache entry
+    register_source(job["code"])
+    return marshal.loads(base64.b64decode(job["bytecode"]))
+
+
+def run_batch(job, protocol_fds):
+    """Compile the submission once and run it against every case in turn"""
+    code = load_code(job) if job.get("bytecode") else compile_submission(job["code"])
+    return {
+        "results": [
+            run_job(job, code, protocol_fds, case.get("stdin"), case.get("args"), case.get("cwd"))
+            for case in job["cases"]
+        ]
+    }
+
+
+def handle(job, protocol_fds):
+    if job.get("type") == "batch":
+        return run_batch(job, protocol_fds)
+    return run_job(job, load_code(job), protocol_fds, job.get("stdin"), job.get("args"))
+
+
+def main():
+    # Keep the protocol on private descriptors so stray writes cannot corrupt it
+    proto_in_fd = os.dup(0)
+    proto_out_fd = os.dup(1)
+    devnull = os.open(os.devnull, os.O_RDWR)
+    os.dup2(devnull, 0)
+    os.dup2(devnull, 1)
+    os.close(devnull)
+    proto_in = os.fdopen(proto_in_fd, "rb", buffering=0)
+    proto_out = os.fdopen(proto_out_fd, "wb", buffering=0)
+
+    write_frame(proto_out, {"ready": True, "pid": os.getpid()})
+    while True:
+        job = read_frame(proto_in)
+        if job is None:
+            break
+        try:
+            result = handle(job, (proto_in_fd, proto_out_fd))
+        except Exception as e:
+            result = {"worker_error": str(e)}
+        write_frame(proto_out, result)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import torch
+
+class PrefixCacheEntry:
+    """Prompt tokens of a session's last request and the KV cache that encodes them"""
+
+    def __init__(self, input_ids: List[int], past_key_values: Any):
+        self.input_ids = input_ids
+        self.past_key_values = past_key_values
+        self.nbytes = cache_nbytes(past_key_values)
+
+
+def cache_nbytes(past_key_values: Any) -> int:
+    """Memory held by the key/value tensors of a KV cache"""
+    if hasattr(past_key_values, "layers"):
+        tensors = [
+            tensor for layer in past_key_values.layers
+            for tensor in (getattr(layer, "keys", None), getattr(layer, "values", None))
+        ]
+    else:
+        # DynamicCache before per-layer cache objects keeps plain tensor lists
+        tensors = list(getattr(past_key_values, "key_cache", [])) + list(getattr(past_key_values, "value_cache", []))
+    return sum(
+        tensor.numel() * tensor.element_size() for tensor in tensors if isinstance(tensor, torch.Tensor)
+    )
+
+
+def common_prefix_length(a: List[int], b: List[int]) -> int:
+    length = min(len(a), len(b))
+    for i in range(length):
+        if a[i] != b[i]:
+            return i
+    return length
+
+
+def crop_to(past_key_values: Any, length: int):
+    """Trim a KV cache to its first ``length`` tokens"""
+    # A negative crop removes tokens from the end, which every DynamicCache version accepts
+    remove = past_key_values.get_seq_length() - length
+    if remove > 0:
+        past_key_values.crop(-remove)
+
+
+class PrefixCache:
+    """
+    Per-session cache of prompt KV state for incremental editor updates
+
+    Consecutive updates from one editor share most of their tokens, so a new
+    prompt only needs the tail after the longest common prefix with the
+    session's previous prompt encoded. Entries are evicted least recently
+    used first once their combined size exceeds ``max_bytes``.
+    """
+
+    def __init__(self, max_bytes: Optional[int] = None):
+        self.max_bytes = max_bytes or int(float(os.getenv("PREFIX_CACHE_MAX_MB", "512")) * 1024 * 1024)
+        self._entries: "OrderedDict[str, PrefixCacheEntry]" = OrderedDict()
+        self._bytes = 0
+        # Entries are used on the inference thread and dropped from the event loop
+        self._lock = threading.Lock()
+
+        self.lookups = 0
+        self.reused_tokens = 0
+        self.encoded_tokens = 0
+        self.evictions = 0
+
+    def _pop(self, session_id: str) -> Optional[PrefixCacheEntry]:
+        entry = self._entries.pop(session_id, None)
+        if entry is not None:
+            self._bytes -= entry.nbytes
+        return entry
+
+    def take(self, session_id: str, input_ids: List[int]) -> Tuple[Optional[Any], int]:
+        """
+        Remove and return a session's cache cropped to what ``input_ids`` can reuse
+
+        At least one token is always left uncached so the model has something
+        to run on.
+
+        Args:
+            session_id (str): Editor session the prompt belongs to
+            input_ids (list): Token ids of the new prompt
+
+        Returns:
+            Tuple of the cropped KV cache (or None) and the number of cached tokens
+        """
+        with self._lock:
+            self.lookups += 1
+            entry = self._pop(session_id)
+        if entry is None:
+            return None, 0
+
+        reuse = min(common_prefix_length(entry.input_ids, input_ids), len(input_ids) - 1)
+        if reuse <= 0:
+            return None, 0
+        crop_to(entry.past_key_values, reuse)
+        return entry.past_key_values, reuse
+
+    def put(self, session_id: str, input_ids: List[int], past_key_values: Any):
+        """Store the KV cache covering ``input_ids`` as the session's prefix"""
+        entry = PrefixCacheEntry(list(input_ids), past_key_values)
+        if entry.nbytes > self.max_bytes:
+            return
+        with self._lock:
+            self._pop(session_id)
+            self._entries[session_id] = entry
+            self._bytes += entry.nbytes
+            while self._bytes > self.max_bytes:
+                self._pop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def record(self, reused: int, encoded: int):
+        self.reused_tokens += reused
+        self.encoded_tokens += encoded
+
+    def drop(self, session_id: str):
+        """Forget a session, e.g. when its WebSocket closes"""
+        with self._lock:
+            self._pop(session_id)
+
+    def get_stats(self) -> Dict[str, Any]:
+        prompt_tokens = self.reused_tokens + self.encoded_tokens
+        return {
+            "sessions": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "lookups": self.lookups,
+            "evictions": self.evictions,
+            "reused_tokens": self.reused_tokens,
+            "encoded_tokens": self.encoded_tokens,
+            "reuse_rate": self.reused_tokens / prompt_tokens if prompt_tokens else 0.0
+        }
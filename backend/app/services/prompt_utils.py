@@ -0,0 +1,98 @@
+import ast
+import re
+from typing import Callable, List, Optional
+
+# Lines kept as an outline of the file however far they are from the cursor
+IMPORT_LINE = re.compile(r"^\s*(?:import\s|from\s+\S+\s+import\s)")
+SIGNATURE_LINE = re.compile(r"^\s*(?:@|(?:async\s+)?def\s|class\s)")
+OMITTED_MARKER = "# ..."
+# Longer code is only whitespace-normalized: parsing it would stall the event loop
+NORMALIZE_MAX_CHARS = 64 * 1024
+
+def truncate_code(code: str, max_tokens: int, count_tokens: Callable[[List[str]], List[int]],
+                  cursor_line: Optional[int] = None) -> str:
+    """
+    Shrink code to a token budget, keeping what matters for the cursor position
+
+    Imports are kept first, then def/class signatures (together at most half
+    the budget), and the rest of the budget goes to a window of lines around
+    the cursor. Skipped runs of lines are replaced with ``# ...``.
+
+    Args:
+        code (str): Full editor buffer
+        max_tokens (int): Token budget for the returned code
+        count_tokens (callable): Returns the token count of each given line
+        cursor_line (int, optional): 1-based cursor line; defaults to the last line
+
+    Returns:
+        The code unchanged if it fits, otherwise the truncated code
+    """
+    lines = code.split("\n")
+    # Every line also costs roughly one token for its newline
+    costs = [count + 1 for count in count_tokens(lines)]
+    if sum(costs) <= max_tokens:
+        return code
+
+    keep = set()
+    # Each gap costs a marker line; the window can add one on either side
+    marker_cost = count_tokens([OMITTED_MARKER])[0] + 1
+    budget = max_tokens - 2 * marker_cost
+
+    outline_budget = max_tokens // 2
+    for pattern in (IMPORT_LINE, SIGNATURE_LINE):
+        for i, line in enumerate(lines):
+            cost = costs[i] + (0 if i - 1 in keep else marker_cost)
+            if i not in keep and pattern.match(line) and cost <= outline_budget:
+                keep.add(i)
+                outline_budget -= cost
+                budget -= cost
+
+    cursor = len(lines) - 1 if cursor_line is None else min(max(cursor_line - 1, 0), len(lines) - 1)
+    # Grow the window outwards from the cursor, preferring the lines above it
+    above, below = cursor, cursor + 1
+    while above >= 0 or below < len(lines):
+        for i in (above, below):
+            if 0 <= i < len(lines) and i not in keep:
+                if costs[i] > budget:
+                    above, below = -1, len(lines)
+                    break
+                keep.add(i)
+                budget -= costs[i]
+        above -= 1
+        below += 1
+
+    result = []
+    skipped = False
+    for i, line in enumerate(lines):
+        if i in keep:
+            result.append(line)
+            skipped = False
+        elif not skipped:
+            result.append(OMITTED_MARKER)
+            skipped = True
+    return "\n".join(result)
+
+
+def trim_at_stop_sequences(text: str, stop_sequences: List[str]) -> str:
+    """Cut generated text at the first stop sequence it contains"""
+    end = len(text)
+    for stop in stop_sequences:
+        index = text.find(stop)
+        if index != -1:
+            end = min(end, index)
+    return text[:end]
+
+
+def normalize_code(code: str) -> str:
+    """
+    Canonical form of Python source, insensitive to comments and formatting
+
+    Code that does not parse (or is too long or deeply nested to parse
+    cheaply) falls back to dropping trailing whitespace and blank lines.
+    """
+    try:
+        if len(code) <= NORMALIZE_MAX_CHARS:
+            return ast.unparse(ast.parse(code))
+    except (SyntaxError, ValueError, RecursionError, MemoryError):
+        pass
+    return "\n".join(line.rstrip() for line in code.splitlines() if line.strip())
@@ -0,0 +1,202 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Awaitable, Callable, Optional, Tuple
+
+class _Flight:
+    """A computation shared by every caller that missed on the same key"""
+
+    def __init__(self, task: "asyncio.Future"):
+        self.task = task
+        self.waiters = 0
+
+
+class ResultCache:
+    """
+    Two-tier cache for JSON-serialisable results
+
+    The first tier is an in-process LRU with a TTL. When ``redis_url`` is set,
+    entries are also written to Redis so other API processes and nodes can
+    reuse them. After a Redis error the cache logs it and uses only the local
+    tier until ``REDIS_RETRY_INTERVAL`` has passed.
+    """
+
+    # Seconds to wait before trying Redis again after an error
+    REDIS_RETRY_INTERVAL = 30.0
+
+    def __init__(self, namespace: str, max_entries: int = 1024, ttl: float = 3600,
+                 redis_url: Optional[str] = None, cost_field: Optional[str] = None):
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.redis_url = redis_url
+        # Result field summed on hits to estimate the work the cache saved
+        self.cost_field = cost_field
+
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._redis = None
+        self._redis_retry_at = 0.0
+        # Computations in progress per key, with how many callers await each
+        self._inflight: Dict[str, _Flight] = {}
+
+        self.hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.shared = 0
+        self.saved_cost = 0.0
+
+    @staticmethod
+    def make_key(*parts: Any) -> str:
+        """Content address for a request: SHA-256 over the canonical JSON of its parts"""
+        payload = json.dumps(parts, sort_keys=True, separators=(",", ":"), default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _get_redis(self):
+        if not self.redis_url or time.monotonic() < self._redis_retry_at:
+            return None
+        if self._redis is None:
+            try:
+                import redis.asyncio as redis_asyncio
+                self._redis = redis_asyncio.from_url(self.redis_url)
+            except Exception as e:
+                self._disable_redis(e)
+        return self._redis
+
+    def _disable_redis(self, error: Exception):
+        if time.monotonic() >= self._redis_retry_at:
+            print(f"Redis cache tier unavailable for {self.namespace}: {str(error)}")
+        self._redis_retry_at = time.monotonic() + self.REDIS_RETRY_INTERVAL
+        self._redis = None
+
+    def _redis_key(self, key: str) -> str:
+        return f"cache:{self.namespace}:{key}"
+
+    def _store_local(self, key: str, value: Dict[str, Any], ttl: float):
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _record_hit(self, value: Dict[str, Any]):
+        self.hits += 1
+        if self.cost_field:
+            self.saved_cost += value.get(self.cost_field) or 0.0
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at > time.monotonic():
+                self._entries.move_to_end(key)
+                self._record_hit(value)
+                return value
+            del self._entries[key]
+
+        redis = self._get_redis()
+        if redis is not None:
+            try:
+                payload = await redis.get(self._redis_key(key))
+            except Exception as e:
+                self._disable_redis(e)
+                payload = None
+            if payload is not None:
+                value = json.loads(payload)
+                self._store_local(key, value, self.ttl)
+                self.redis_hits += 1
+                self._record_hit(value)
+                return value
+
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, value: Dict[str, Any], ttl: Optional[float] = None):
+        ttl = ttl or self.ttl
+        self._store_local(key, value, ttl)
+        self.stores += 1
+
+        redis = self._get_redis()
+        if redis is not None:
+            try:
+                await redis.set(self._redis_key(key), json.dumps(value), ex=int(ttl))
+            except Exception as e:
+                self._disable_redis(e)
+
+    async def _compute_and_store(self, key: str, compute: Callable[[], Awaitable[Dict[str, Any]]],
+                                 ttl: Optional[float]) -> Dict[str, Any]:
+        value = await compute()
+        await self.set(key, value, ttl)
+        return value
+
+    async def get_or_compute(self, key: str, compute: Callable[[], Awaitable[Dict[str, Any]]],
+                             ttl: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Return the cached value for ``key``, computing and storing it on a miss
+
+        Concurrent misses for the same key share a single ``compute`` call
+        (single flight). It is cancelled only once every caller waiting on it
+        has been cancelled, and results are stored only when it succeeds.
+
+        Args:
+            key (str): Cache key, usually from ``make_key``
+            compute (callable): Coroutine function producing the value
+            ttl (float, optional): Overrides the cache's TTL for this entry
+
+        Returns:
+            The cached or freshly computed value
+        """
+        cached = await self.get(key)
+        if cached is not None:
+            return cached
+
+        flight = self._inflight.get(key)
+        if flight is None:
+            flight = _Flight(asyncio.ensure_future(self._compute_and_store(key, compute, ttl)))
+            self._inflight[key] = flight
+            flight.task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self.shared += 1
+
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                flight.task.cancel()
+
+    def clear(self):
+        self._entries.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "redis_enabled": bool(self.redis_url) and time.monotonic() >= self._redis_retry_at,
+            "hits": self.hits,
+            "redis_hits": self.redis_hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "stores": self.stores,
+            "evictions": self.evictions,
+            "shared": self.shared,
+            "inflight": len(self._inflight),
+            "saved_" + (self.cost_field or "cost"): self.saved_cost
+        }
+
+def cache_from_env(namespace: str, prefix: str, cost_field: Optional[str] = None) -> ResultCache:
+    """Build a cache configured by ``<prefix>_CACHE_SIZE``, ``<prefix>_CACHE_TTL`` and ``REDIS_URL``"""
+    return ResultCache(
+        namespace,
+        max_entries=int(os.getenv(f"{prefix}_CACHE_SIZE", "1024")),
+        ttl=float(os.getenv(f"{prefix}_CACHE_TTL", "3600")),
+        redis_url=os.getenv("REDIS_URL") or None,
+        cost_field=cost_field
+    )
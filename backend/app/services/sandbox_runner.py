@@ -0,0 +1,176 @@
+"""
+Entry point for running a single submission in this interpreter
+
+The executor starts ``python sandbox_runner.py`` and delivers the source
+without touching the filesystem, either over stdin (a decimal byte count
+on the first line followed by the source, leaving the rest of stdin to
+the program) or through an inherited file descriptor such as a memfd
+(``--fd N``), or from a file (``--file PATH``). Arguments after ``--``
+become the program's ``sys.argv[1:]``. ``--limits JSON`` is a resource
+profile the runner applies to itself before running the submission. With
+``--usage-fd N`` the runner writes its resource usage as JSON to that
+descriptor before exiting. The pool worker reuses ``run_child`` and
+``apply_resource_limits``. This file must only depend on the standard
+library.
+"""
+
+import builtins
+import json
+import linecache
+import os
+import resource
+import sys
+import traceback
+import types
+
+# Resource profile keys and the rlimit each one maps to
+RLIMITS = {
+    "cpu_seconds": resource.RLIMIT_CPU,
+    "memory_bytes": resource.RLIMIT_AS,
+    "max_processes": resource.RLIMIT_NPROC,
+    "max_open_files": resource.RLIMIT_NOFILE,
+    "max_file_bytes": resource.RLIMIT_FSIZE,
+}
+
+# ru_maxrss is reported in kilobytes on Linux and in bytes on macOS
+MAXRSS_SCALE = 1 if sys.platform == "darwin" else 1024
+
+
+def apply_resource_limits(limits):
+    """Lower the rlimits of the current process; safe to call between fork and exec"""
+    for name, value in (limits or {}).items():
+        rlimit = RLIMITS.get(name)
+        if rlimit is None or value is None:
+            continue
+        _, hard = resource.getrlimit(rlimit)
+        if hard != resource.RLIM_INFINITY:
+            value = min(value, hard)
+        # A CPU hard limit one second above the soft one delivers SIGXCPU before SIGKILL
+        new_hard = value + 1 if rlimit == resource.RLIMIT_CPU else value
+        if hard != resource.RLIM_INFINITY:
+            new_hard = min(new_hard, hard)
+        resource.setrlimit(rlimit, (value, new_hard))
+
+
+def format_resource_usage(*usages):
+    """Combine rusage structs into the ``resource_usage`` block of a result"""
+    return {
+        "peak_rss_bytes": max(usage.ru_maxrss for usage in usages) * MAXRSS_SCALE,
+        "user_cpu_time": sum(usage.ru_utime for usage in usages),
+        "system_cpu_time": sum(usage.ru_stime for usage in usages),
+    }
+
+
+def read_peak_rss():
+    """High-water RSS of this process since exec, or None without /proc"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def register_source(code):
+    """Decode the submission and let tracebacks quote its source lines"""
+    if isinstance(code, bytes):
+        code = code.decode("utf-8", errors="replace")
+    linecache.cache["<submission>"] = (len(code), None, code.splitlines(True), "<submission>")
+    return code
+
+
+def compile_submission(code):
+    """Compile once for many runs; on a syntax error the source is returned so each run reports it"""
+    code = register_source(code)
+    try:
+        return compile(code, "<submission>", "exec")
+    except (SyntaxError, ValueError):
+        return code
+
+
+def run_child(code, args=None):
+    """Execute user code (source or code object) as ``__main__`` and return the exit status"""
+    main_module = types.ModuleType("__main__")
+    main_module.__builtins__ = builtins
+    sys.modules["__main__"] = main_module
+    sys.argv = ["<submission>"] + list(args or [])
+    sys.path[0] = os.getcwd()
+    if not isinstance(code, types.CodeType):
+        code = register_source(code)
+    status = 0
+    try:
+        if not isinstance(code, types.CodeType):
+            code = compile(code, "<submission>", "exec")
+        exec(code, main_module.__dict__)
+    except SystemExit as e:
+        if e.code is None:
+            status = 0
+        elif isinstance(e.code, int):
+            status = e.code
+        else:
+            print(e.code, file=sys.stderr)
+            status = 1
+    except BaseException:
+        etype, value, tb = sys.exc_info()
+        # Drop this frame so tracebacks look like a plain `python file.py` run
+        traceback.print_exception(etype, value, tb.tb_next)
+        status = 1
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        except Exception:
+            pass
+    return status
+
+
+def parse_args(argv):
+    """Split ``--flag value`` pairs from the program arguments that follow ``--``"""
+    args = []
+    if "--" in argv:
+        index = argv.index("--")
+        argv, args = argv[:index], argv[index + 1:]
+    options = {}
+    for flag, value in zip(argv[::2], argv[1::2]):
+        options[flag.lstrip("-")] = value
+    return options, args
+
+
+def read_source(options):
+    if "fd" in options:
+        with os.fdopen(int(options["fd"]), "rb") as f:
+            return f.read()
+    if "file" in options:
+        with open(options["file"], "rb") as f:
+            return f.read()
+    length = int(sys.stdin.buffer.readline())
+    return sys.stdin.buffer.read(length)
+
+
+def report_usage(fd):
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    usage = format_resource_usage(resource.getrusage(resource.RUSAGE_SELF), children)
+    # ru_maxrss of this process carries over from the server through fork and exec
+    peak_rss = read_peak_rss()
+    if peak_rss is not None:
+        usage["peak_rss_bytes"] = max(peak_rss, children.ru_maxrss * MAXRSS_SCALE)
+    try:
+        os.write(fd, json.dumps(usage).encode("utf-8"))
+        os.close(fd)
+    except OSError:
+        pass
+
+
+if __name__ == "__main__":
+    options, args = parse_args(sys.argv[1:])
+    if "limits" in options:
+        apply_resource_limits(json.loads(options["limits"]))
+    source = read_source(options)
+    runner_pid = os.getpid()
+    status = run_child(source, args)
+    # Processes forked by the submission also return here; only the runner reports
+    if "usage-fd" in options and os.getpid() == runner_pid:
+        report_usage(int(options["usage-fd"]))
+    os._exit(status)
@@ -0,0 +1,271 @@
+import asyncio
+import base64
+import json
+import os
+import signal
+import struct
+import tempfile
+import time
+from collections import deque
+from typing import Dict, Any, List, Optional
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pool_worker.py")
+HEADER = struct.Struct(">I")
+
+class WorkerError(Exception):
+    """Raised when a pool worker dies or breaks the protocol"""
+
+
+def _encode_bytecode(bytecode: Optional[bytes]) -> Optional[str]:
+    # Frames are JSON, so marshal data travels as base64
+    return base64.b64encode(bytecode).decode("ascii") if bytecode is not None else None
+
+
+class PoolWorker:
+    """A single pre-started interpreter owned by the pool"""
+
+    def __init__(self, process: asyncio.subprocess.Process):
+        self.process = process
+        self.runs = 0
+        self.started_at = time.time()
+
+    @property
+    def alive(self) -> bool:
+        return self.process.returncode is None
+
+    async def request(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        payload = json.dumps(message).encode("utf-8")
+        try:
+            self.process.stdin.write(HEADER.pack(len(payload)) + payload)
+            await self.process.stdin.drain()
+            return await self.read()
+        except (ConnectionError, asyncio.IncompleteReadError) as e:
+            raise WorkerError(f"Worker {self.process.pid} exited unexpectedly") from e
+
+    async def read(self) -> Dict[str, Any]:
+        header = await self.process.stdout.readexactly(HEADER.size)
+        (length,) = HEADER.unpack(header)
+        payload = await self.process.stdout.readexactly(length)
+        return json.loads(payload.decode("utf-8"))
+
+    async def kill(self):
+        if self.alive:
+            try:
+                os.killpg(self.process.pid, signal.SIGKILL)
+            except (ProcessLookupError, PermissionError):
+                pass
+        await self.process.wait()
+
+
+class WorkerPool:
+    """
+    Pool of warm Python interpreters that run submissions in forked children
+
+    Workers are started ahead of time so a run costs a fork instead of a full
+    interpreter startup. Each worker is retired after ``max_runs_per_worker``
+    jobs to bound any state that leaks into the long-lived parent.
+    """
+
+    def __init__(self, python_path: str = "python", min_size: Optional[int] = None,
+                 max_size: Optional[int] = None, max_runs_per_worker: Optional[int] = None):
+        self.python_path = python_path
+        self.min_size = min_size if min_size is not None else int(os.getenv("EXECUTION_POOL_MIN_SIZE", "2"))
+        self.max_size = max(max_size or int(os.getenv("EXECUTION_POOL_MAX_SIZE", "8")), self.min_size)
+        self.max_runs_per_worker = max_runs_per_worker or int(os.getenv("EXECUTION_POOL_MAX_RUNS", "100"))
+        # Grace period on top of the job timeout before the worker itself is killed
+        self.kill_grace = 5.0
+
+        self._idle: deque = deque()
+        self._size = 0
+        self._condition: Optional[asyncio.Condition] = None
+        self._started = False
+        self._closed = False
+
+        self.spawned_total = 0
+        self.recycled_total = 0
+        self.killed_total = 0
+        self.runs_total = 0
+        self.run_time_total = 0.0
+
+    def _get_condition(self) -> asyncio.Condition:
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+
+    async def start(self):
+        """Pre-start ``min_size`` workers"""
+        if self._started:
+            return
+        self._started = True
+        workers = await asyncio.gather(
+            *[self._spawn() for _ in range(self.min_size)], return_exceptions=True
+        )
+        for worker in workers:
+            if isinstance(worker, PoolWorker):
+                self._idle.append(worker)
+
+    async def _spawn(self) -> PoolWorker:
+        self._size += 1
+        try:
+            process = await asyncio.create_subprocess_exec(
+                self.python_path, "-u", WORKER_SCRIPT,
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.DEVNULL,
+                cwd=tempfile.gettempdir(),
+                start_new_session=True
+            )
+            worker = PoolWorker(process)
+            ready = await worker.read()
+            if not ready.get("ready"):
+                await worker.kill()
+                raise WorkerError("Worker failed to start")
+        except BaseException:
+            self._size -= 1
+            raise
+        self.spawned_total += 1
+        return worker
+
+    async def _acquire(self) -> PoolWorker:
+        condition = self._get_condition()
+        async with condition:
+            while True:
+                while self._idle:
+                    worker = self._idle.popleft()
+                    if worker.alive:
+                        return worker
+                    self._size -= 1
+                if self._size < self.max_size:
+                    break
+                await condition.wait()
+        return await self._spawn()
+
+    async def _release(self, worker: PoolWorker, discard: bool = False):
+        if discard or not worker.alive or worker.runs >= self.max_runs_per_worker or self._closed:
+            if worker.alive and not discard:
+                self.recycled_total += 1
+            await worker.kill()
+            self._size -= 1
+            if not self._closed and self._size < self.min_size:
+                try:
+                    self._idle.append(await self._spawn())
+                except Exception as e:
+                    print(f"Error replacing pool worker: {str(e)}")
+        else:
+            self._idle.append(worker)
+        condition = self._get_condition()
+        async with condition:
+            condition.notify()
+
+    async def _submit(self, message: Dict[str, Any], wait_timeout: float, runs: int = 1) -> Dict[str, Any]:
+        """Send one job to an idle worker and wait for its response"""
+        if not self._started:
+            await self.start()
+
+        worker = await self._acquire()
+        discard = False
+        try:
+            response = await asyncio.wait_for(worker.request(message), timeout=wait_timeout)
+            worker.runs += runs
+            if "worker_error" in response:
+                discard = True
+                raise WorkerError(response["worker_error"])
+            results = response.get("results", [response])
+            self.runs_total += len(results)
+            self.run_time_total += sum(result.get("execution_time", 0.0) for result in results)
+            return response
+        except BaseException:
+            # Timeouts, protocol errors and cancellation leave the worker in an unknown state
+            discard = True
+            self.killed_total += 1
+            raise
+        finally:
+            await self._release(worker, discard=discard)
+
+    async def run(self, code: str, timeout: float, cwd: Optional[str] = None,
+                  limits: Optional[Dict[str, Any]] = None, env: Optional[Dict[str, str]] = None,
+                  stdin: Optional[str] = None, args: Optional[List[str]] = None,
+                  bytecode: Optional[bytes] = None) -> Dict[str, Any]:
+        """
+        Run code on a warm worker
+
+        Args:
+            code (str): Python source to execute
+            timeout (float): Wall-clock limit enforced by the worker
+            cwd (str, optional): Working directory for the forked child
+            limits (dict, optional): Resource profile applied to the forked child
+            env (dict, optional): Extra environment variables for the forked child
+            stdin (str, optional): Data fed to the program's stdin
+            args (list, optional): Program arguments placed in sys.argv[1:]
+            bytecode (bytes, optional): Marshalled code object for ``code``, run
+                instead of compiling it; only valid for this pool's Python version
+
+        Returns:
+            Raw worker response with returncode, stdout, stderr and timing
+        """
+        return await self._submit({
+            "code": code,
+            "timeout": timeout,
+            "cwd": cwd,
+            "limits": limits,
+            "env": env,
+            "stdin": stdin,
+            "args": args,
+            "bytecode": _encode_bytecode(bytecode),
+            "max_output_bytes": (limits or {}).get("max_output_bytes")
+        }, timeout + self.kill_grace)
+
+    async def run_batch(self, code: str, cases: List[Dict[str, Any]], timeout: float,
+                        limits: Optional[Dict[str, Any]] = None,
+                        env: Optional[Dict[str, str]] = None,
+                        bytecode: Optional[bytes] = None) -> List[Dict[str, Any]]:
+        """
+        Run code against several cases on one worker, compiling it only once
+
+        Args:
+            code (str): Python source to execute
+            cases (list): Dicts with optional stdin, args and cwd for each run
+            timeout (float): Wall-clock limit for each case
+            limits (dict, optional): Resource profile applied to every forked child
+            env (dict, optional): Extra environment variables for every forked child
+            bytecode (bytes, optional): Marshalled code object for ``code``
+
+        Returns:
+            Raw worker responses, one per case and in the same order
+        """
+        response = await self._submit({
+            "type": "batch",
+            "code": code,
+            "cases": cases,
+            "bytecode": _encode_bytecode(bytecode),
+            "timeout": timeout,
+            "limits": limits,
+            "env": env,
+            "max_output_bytes": (limits or {}).get("max_output_bytes")
+        }, timeout * len(cases) + self.kill_grace, runs=len(cases))
+        return response["results"]
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Snapshot of pool size and throughput counters"""
+        idle = len(self._idle)
+        return {
+            "size": self._size,
+            "idle": idle,
+            "busy": self._size - idle,
+            "min_size": self.min_size,
+            "max_size": self.max_size,
+            "max_runs_per_worker": self.max_runs_per_worker,
+            "spawned_total": self.spawned_total,
+            "recycled_total": self.recycled_total,
+            "killed_total": self.killed_total,
+            "runs_total": self.runs_total,
+            "avg_run_time": self.run_time_total / self.runs_total if self.runs_total else 0.0
+        }
+
+    async def shutdown(self):
+        """Stop all idle workers; busy ones are stopped when released"""
+        self._closed = True
+        while self._idle:
+            worker = self._idle.popleft()
+            await worker.kill()
+            self._size -= 1
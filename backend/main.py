@@ -1,15 +1,43 @@
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from fastapi import APIRouter, FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from typing import List
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from typing import List, Optional
+import asyncio
 import uvicorn
 import json
+import os
+import time
+import uuid
 
 # Import our services and routes
-from app.api.code_routes import router as code_router
+from app.api.code_routes import router as code_router, CodeExecutionRequest, MAX_CODE_BYTES, run_execution
 from app.services.code_executor import code_executor
-from app.services.llm_service import llm_service
+from app.services.connection_manager import manager
+from app.services.inference_executor import InferenceQueueFull
+from app.services.metrics import (
+    HTTP_REQUEST_SECONDS, WEBSOCKET_MESSAGE_SECONDS, metrics, monitor_event_loop, trace_id_var
+)
+
+# Which subsystems this process serves: all, execute (sandbox nodes) or llm
+SERVICE_ROLE = os.getenv("SERVICE_ROLE", "all").lower()
+if SERVICE_ROLE not in ("all", "execute", "llm"):
+    raise ValueError(f"Unknown SERVICE_ROLE '{SERVICE_ROLE}', expected all, execute or llm")
+SERVES_EXECUTION = SERVICE_ROLE in ("all", "execute")
+SERVES_LLM = SERVICE_ROLE in ("all", "llm")
+
+def get_llm_service():
+    """
+    The LLM service, imported on first use
+
+    Importing it pulls in torch and transformers, so execute-only nodes
+    never call this and start without them.
+    """
+    from app.services.llm_service import llm_service
+    return llm_service
 
 app = FastAPI(title="AI Coding Platform API")
+execution_router = APIRouter()
+llm_router = APIRouter()
 
 # Configure CORS
 app.add_middleware(
@@ -20,85 +48,350 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Include API routes
-app.include_router(code_router, prefix="/api", tags=["code"])
-
-# WebSocket connection manager
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: List[WebSocket] = []
-
-    async def connect(self, websocket: WebSocket):
-        await websocket.accept()
-        self.active_connections.append(websocket)
+# Echo a per-request trace id in the X-Trace-Id response header
+TRACE_REQUESTS = os.getenv("TRACE_REQUESTS", "true").lower() == "true"
 
-    def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
-
-    async def send_suggestion(self, message: str, websocket: WebSocket):
-        await websocket.send_text(message)
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    """Time every request and tag it with the client's X-Trace-Id or a new one"""
+    trace_id = request.headers.get("x-trace-id") or uuid.uuid4().hex
+    token = trace_id_var.set(trace_id)
+    started = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        trace_id_var.reset(token)
+    route = request.scope.get("route")
+    HTTP_REQUEST_SECONDS.observe(
+        time.perf_counter() - started,
+        method=request.method,
+        # Route templates rather than raw paths keep label cardinality bounded
+        route=route.path if route is not None else "unmatched",
+        status=str(response.status_code)
+    )
+    if TRACE_REQUESTS:
+        response.headers["X-Trace-Id"] = trace_id
+    return response
 
-manager = ConnectionManager()
 
 @app.on_event("startup")
 async def startup_event():
     """Initialize services on startup"""
-    print("Initializing AI Coding Platform...")
-    # Initialize LLM service (this might take some time)
-    await llm_service.initialize()
-    print("Platform ready!")
+    print(f"Initializing AI Coding Platform ({SERVICE_ROLE})...")
+    if SERVES_EXECUTION:
+        # Start warm execution workers before the first request arrives
+        await code_executor.start()
+    if SERVES_LLM:
+        # Load the model in the background so the API serves requests right away;
+        # /ready reports progress and LLM requests wait for it to finish
+        get_llm_service().start_loading()
+    app.state.loop_monitor = asyncio.create_task(monitor_event_loop())
+    print("Platform ready! Model loading in background" if SERVES_LLM else "Platform ready!")
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop background execution and inference workers"""
+    app.state.loop_monitor.cancel()
+    if SERVES_EXECUTION:
+        await code_executor.shutdown()
+    if SERVES_LLM:
+        get_llm_service().inference.shutdown()
 
 @app.get("/")
 async def root():
     """Root endpoint to verify API is running"""
     return {"message": "AI Coding Platform API is running"}
 
-@app.post("/execute")
-async def execute_code_endpoint(request: dict):
+@app.get("/ready")
+async def readiness_check():
+    """Readiness probe: 200 once the model is loaded, 503 with loading progress before that"""
+    if not SERVES_LLM:
+        return {"stage": "ready", "progress": 1.0, "error": None, "ready": True, "role": SERVICE_ROLE}
+    state = get_llm_service().get_load_state()
+    return JSONResponse(status_code=200 if state["ready"] else 503, content=state)
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Latency histograms in the Prometheus text format"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@execution_router.post("/execute")
+async def execute_code_endpoint(request: CodeExecutionRequest):
     """Execute Python code"""
+    return await run_execution(request)
+
+def sse_event(payload: dict) -> str:
+    """Format a payload as a Server-Sent Events message"""
+    return f"data: {json.dumps(payload)}\n\n"
+
+async def stream_explanation_events(code: str, detail_level: str, include_suggestions: bool,
+                                    cursor_line: Optional[int]):
+    """
+    Explanation as SSE: text deltas while generating, then the full result
+
+    Identical concurrent requests share one generation like the JSON path;
+    only the request that started it receives the deltas.
+    """
+    llm_service = get_llm_service()
+    try:
+        if not llm_service.initialized:
+            # The cache key includes the model version, which is only known once loaded
+            await llm_service.initialize()
+        key = llm_service.explanation_cache_key(code, detail_level, include_suggestions, cursor_line)
+        cached = await llm_service.explanation_cache.get(key) if key is not None else None
+    except Exception as e:
+        print(f"Error streaming explanation: {str(e)}")
+        yield sse_event({"type": "error", "error": "Error generating explanation"})
+        return
+    if cached is not None:
+        yield sse_event({"type": "explanation_complete", **cached})
+        return
+
+    deltas: asyncio.Queue = asyncio.Queue()
+
+    async def generate() -> dict:
+        parts = []
+        started = time.monotonic()
+        suggestions = await llm_service.get_recent_suggestions(code) if include_suggestions else []
+        with_suggestions = suggestions is None
+        async for delta in llm_service.stream_explanation(code, detail_level, with_suggestions, cursor_line):
+            parts.append(delta)
+            deltas.put_nowait(delta)
+
+        text = "".join(parts).strip()
+        if with_suggestions:
+            result = llm_service.parse_explanation(text)
+        else:
+            result = {"explanation": text, "suggestions": suggestions}
+        result["generation_time"] = time.monotonic() - started
+        return result
+
+    task = asyncio.ensure_future(
+        llm_service.explanation_cache.get_or_compute(key, generate) if key is not None else generate()
+    )
+    # Deltas are queued before the task resolves, so this marker always arrives last
+    task.add_done_callback(lambda _: deltas.put_nowait(None))
+    try:
+        while True:
+            delta = await deltas.get()
+            if delta is None:
+                break
+            yield sse_event({"type": "explanation_delta", "content": delta})
+        result = await task
+    except InferenceQueueFull as e:
+        yield sse_event({"type": "error", "error": str(e), "overloaded": True})
+        return
+    except Exception as e:
+        print(f"Error streaming explanation: {str(e)}")
+        yield sse_event({"type": "error", "error": "Error generating explanation"})
+        return
+    finally:
+        # Client went away; get_or_compute keeps generating for any other waiters
+        if not task.done():
+            task.cancel()
+    yield sse_event({"type": "explanation_complete", **result})
+
+@llm_router.post("/explain")
+async def explain_code_endpoint(request: dict, http_request: Request):
+    """Get code explanation from LLM, streamed as SSE when requested"""
     code = request.get("code", "")
-    timeout = request.get("timeout", 30)
-    
-    result = await code_executor.execute_python_code(code, timeout)
-    return result
-
-@app.post("/explain")
-async def explain_code_endpoint(request: dict):
-    """Get code explanation from LLM"""
-    code = request.get("code", "")
+    if not isinstance(code, str):
+        raise HTTPException(status_code=422, detail="code must be a string")
+    if len(code.encode("utf-8", errors="surrogatepass")) > MAX_CODE_BYTES:
+        raise HTTPException(status_code=422, detail=f"Code must be at most {MAX_CODE_BYTES} bytes")
     detail_level = request.get("detail_level", "medium")
-    
-    result = await llm_service.explain_code(code, detail_level)
-    return result
+    include_suggestions = bool(request.get("include_suggestions", True))
+    cursor_line = request.get("cursor_line")
+    if not isinstance(cursor_line, int):
+        cursor_line = None
+
+    if request.get("stream") or "text/event-stream" in http_request.headers.get("accept", ""):
+        return StreamingResponse(
+            stream_explanation_events(code, detail_level, include_suggestions, cursor_line),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
 
-@app.websocket("/ws/code-suggestions")
+    try:
+        return await get_llm_service().explain_code(code, detail_level, include_suggestions, cursor_line)
+    except InferenceQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+
+async def send_suggestions(websocket: WebSocket, code: str, seq: int, stream: bool = False,
+                           session_id: Optional[str] = None, cursor_line: Optional[int] = None,
+                           received_at: Optional[float] = None):
+    """Generate suggestions for one editor update and send them to the client"""
+    received_at = received_at or time.perf_counter()
+    try:
+        await generate_and_send_suggestions(websocket, code, seq, stream, session_id, cursor_line)
+    except asyncio.CancelledError:
+        WEBSOCKET_MESSAGE_SECONDS.observe(
+            time.perf_counter() - received_at, endpoint="code-suggestions", outcome="cancelled"
+        )
+        raise
+    WEBSOCKET_MESSAGE_SECONDS.observe(time.perf_counter() - received_at, endpoint="code-suggestions", outcome="sent")
+
+async def generate_and_send_suggestions(websocket: WebSocket, code: str, seq: int, stream: bool,
+                                        session_id: Optional[str], cursor_line: Optional[int]):
+    try:
+        suggestions = await generate_suggestion_list(websocket, code, seq, stream, session_id, cursor_line)
+    except InferenceQueueFull as e:
+        # Tell a saturated server apart from "no suggestions"; the editor keeps its current ones
+        await manager.send(websocket, json.dumps({"type": "error", "seq": seq, "error": str(e), "overloaded": True}))
+        return
+    if suggestions is None:
+        return
+    response = {
+        "type": "suggestions",
+        "seq": seq,
+        "content": suggestions
+    }
+    await manager.send_suggestion(json.dumps(response), websocket)
+
+async def generate_suggestion_list(websocket: WebSocket, code: str, seq: int, stream: bool,
+                                   session_id: Optional[str], cursor_line: Optional[int]) -> Optional[List[str]]:
+    """Suggestions for one update, streaming deltas first when asked; None once the client is gone"""
+    if stream:
+        parts = []
+        try:
+            async for delta in get_llm_service().stream_suggestion(code, cursor_line):
+                parts.append(delta)
+                # The client rebuilds the text from every delta, so none may be dropped
+                if not await manager.send(
+                    websocket, json.dumps({"type": "suggestion_delta", "seq": seq, "content": delta})
+                ):
+                    return None
+            return ["".join(parts).strip()]
+        except (WebSocketDisconnect, InferenceQueueFull):
+            raise
+        except Exception as e:
+            print(f"Error streaming suggestions: {str(e)}")
+            return []
+    return await get_llm_service().generate_suggestions(code, session_id, cursor_line)
+
+@llm_router.websocket("/ws/code-suggestions")
 async def websocket_endpoint(websocket: WebSocket):
-    """WebSocket endpoint for real-time code suggestions"""
-    await manager.connect(websocket)
+    """
+    WebSocket endpoint for real-time code suggestions
+
+    Updates are coalesced per connection: only the newest buffer is kept
+    pending, and a newer update cancels generation for an older one. Every
+    response carries the ``seq`` of the update it answers (the client's own
+    ``seq`` when sent, otherwise a per-connection counter).
+    """
+    await manager.connect(websocket, "code-suggestions")
+    session_id = uuid.uuid4().hex
+    # Generation runs as a task while we keep reading, so newer updates and
+    # disconnects are noticed mid-generation and the inference job cancelled
+    latest_seq = 0
+    pending = None
+    generation = None
+    receiver = None
+    try:
+        while True:
+            if generation is None and pending is not None:
+                code, seq, stream, cursor_line, received_at = pending
+                pending = None
+                generation = asyncio.create_task(
+                    send_suggestions(websocket, code, seq, stream, session_id, cursor_line, received_at)
+                )
+            if receiver is None:
+                receiver = asyncio.create_task(websocket.receive_text())
+
+            waiting = {receiver} if generation is None else {receiver, generation}
+            done, _ = await asyncio.wait(waiting, return_when=asyncio.FIRST_COMPLETED)
+
+            if generation in done:
+                task, generation = generation, None
+                task.result()
+            if receiver in done:
+                task, receiver = receiver, None
+                data = task.result()
+                manager.touch(websocket)
+                try:
+                    message = json.loads(data)
+                    if message.get("type") != "code_update":
+                        continue
+                    code = message.get("content", "")
+                    stream = bool(message.get("stream"))
+                    seq = message.get("seq")
+                    cursor_line = message.get("cursor_line")
+                except json.JSONDecodeError:
+                    # Handle plain text messages
+                    code, stream, seq, cursor_line = data, False, None, None
+                latest_seq = seq if isinstance(seq, int) else latest_seq + 1
+
+                # Anything older than this update is already stale
+                pending = (
+                    code, latest_seq, stream,
+                    cursor_line if isinstance(cursor_line, int) else None,
+                    time.perf_counter()
+                )
+                if generation is not None:
+                    generation.cancel()
+                    generation = None
+    except WebSocketDisconnect:
+        pass
+    finally:
+        manager.disconnect(websocket)
+        for task in (generation, receiver):
+            if task is not None:
+                task.cancel()
+        get_llm_service().end_session(session_id)
+
+@execution_router.websocket("/ws/execute")
+async def execute_stream_endpoint(websocket: WebSocket):
+    """WebSocket endpoint that streams execution output as it is produced"""
+    await manager.connect(websocket, "execute")
     try:
         while True:
             data = await websocket.receive_text()
+            manager.touch(websocket)
             try:
                 message = json.loads(data)
-                if message.get("type") == "code_update":
-                    code = message.get("content", "")
-                    # Generate suggestions using LLM
-                    suggestions = await llm_service.generate_suggestions(code)
-                    response = {
-                        "type": "suggestions",
-                        "content": suggestions
-                    }
-                    await manager.send_suggestion(json.dumps(response), websocket)
             except json.JSONDecodeError:
-                # Handle plain text messages
-                suggestions = await llm_service.generate_suggestions(data)
-                response = {
-                    "type": "suggestions", 
-                    "content": suggestions
-                }
-                await manager.send_suggestion(json.dumps(response), websocket)
+                await manager.send(websocket, json.dumps({"type": "error", "error": "Invalid JSON message"}))
+                continue
+            if message.get("type") != "execute":
+                continue
+            received_at = time.perf_counter()
+
+            try:
+                request = CodeExecutionRequest(
+                    **{key: value for key, value in message.items() if key != "type"}
+                )
+                config = request.to_execution_config()
+            except ValueError as e:
+                await manager.send(websocket, json.dumps({"type": "error", "error": str(e)}))
+                continue
+
+            events = code_executor.stream_python_code(request.code, config=config)
+            try:
+                async for event in events:
+                    # Waiting for queue room is what applies backpressure to the program
+                    if not await manager.send(websocket, json.dumps(event)):
+                        break
+            finally:
+                await events.aclose()
+                WEBSOCKET_MESSAGE_SECONDS.observe(
+                    time.perf_counter() - received_at, endpoint="execute", outcome="sent"
+                )
     except WebSocketDisconnect:
+        pass
+    finally:
         manager.disconnect(websocket)
 
+@app.get("/connections/stats")
+async def connection_stats():
+    """Open WebSocket connections and their outbound queue depths"""
+    return manager.get_stats()
+
+# Only the routes of the subsystems this role serves are registered
+if SERVES_EXECUTION:
+    app.include_router(code_router, prefix="/api", tags=["code"])
+    app.include_router(execution_router)
+if SERVES_LLM:
+    app.include_router(llm_router)
+
 if __name__ == "__main__":
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
@@ -0,0 +1,32 @@
+import asyncio
+import os
+import signal
+
+from app.services.code_executor import CodeExecutor
+from app.services.job_queue import JobWorker, job_queue_from_env, parse_queue_concurrency
+
+async def main():
+    """Run queued executions until SIGTERM or SIGINT"""
+    executor = CodeExecutor(engine=os.getenv("WORKER_EXECUTION_ENGINE", "subprocess"))
+    queue = job_queue_from_env()
+    concurrency = parse_queue_concurrency(os.getenv("WORKER_QUEUES", "execute:4,batch:2"))
+    worker = JobWorker(queue, executor.job_handlers(), concurrency)
+
+    await executor.start()
+    task = asyncio.ensure_future(worker.run())
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, task.cancel)
+
+    print(f"Execution worker {worker.worker_id} serving {concurrency}")
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+    finally:
+        await executor.shutdown()
+        await queue.close()
+        print(f"Execution worker {worker.worker_id} stopped")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+"""
+Load-testing and benchmark harness for AI Coding Platform
+Drives /execute, /explain and /ws/code-suggestions at a fixed concurrency and
+reports latency percentiles, throughput and error rates as JSON
+
+Run against a live server, or pass --spawn to start one with the stub model
+(LLM_BACKEND=stub) so the benchmark runs offline without model weights:
+
+    python benchmark_platform.py --spawn --concurrency 8 --requests 200 --output run.json
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import httpx
+import websockets
+
+SCENARIOS = ("execute", "explain", "suggestions")
+
+EXECUTE_CODE = """
+values = [i * i for i in range({n})]
+print(sum(values))
+"""
+
+EXPLAIN_CODE = """
+def fibonacci(n):
+    if n <= 1:
+        return n
+    return fibonacci(n - 1) + fibonacci(n - 2)
+
+result = fibonacci({n})
+"""
+
+SUGGESTION_CODE = """
+def process(items):
+    total = {n}
+    for item in items:
+"""
+
+def percentile(values: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not values:
+        return 0.0
+    return values[max(0, math.ceil(fraction * len(values)) - 1)]
+
+def summarize(latencies: List[float], errors: int, wall_time: float) -> Dict[str, Any]:
+    """Latency percentiles (ms), throughput and error rate for one scenario"""
+    ordered = sorted(latencies)
+    total = len(latencies) + errors
+    return {
+        "requests": total,
+        "errors": errors,
+        "error_rate": errors / total if total else 0.0,
+        "wall_time": wall_time,
+        "throughput": len(latencies) / wall_time if wall_time else 0.0,
+        "latency_ms": {
+            "p50": percentile(ordered, 0.50) * 1000,
+            "p95": percentile(ordered, 0.95) * 1000,
+            "p99": percentile(ordered, 0.99) * 1000,
+            "mean": sum(ordered) / len(ordered) * 1000 if ordered else 0.0,
+            "max": ordered[-1] * 1000 if ordered else 0.0
+        }
+    }
+
+class Benchmark:
+    def __init__(self, base_url: str, concurrency: int, requests: int, warmup: int,
+                 timeout: float, unique: bool):
+        self.base_url = base_url.rstrip("/")
+        self.ws_url = "ws" + self.base_url[len("http"):]
+        self.concurrency = concurrency
+        self.requests = requests
+        self.warmup = warmup
+        self.timeout = timeout
+        # Unique code per request defeats the result caches, so every request does real work
+        self.unique = unique
+
+    def code(self, template: str, index: int) -> str:
+        return template.format(n=index if self.unique else 0)
+
+    async def run_scenario(self, name: str, connect: Callable[[], Awaitable[Any]],
+                           request: Callable[[Any, int], Awaitable[bool]],
+                           close: Callable[[Any], Awaitable[None]]) -> Dict[str, Any]:
+        """
+        Issue ``requests`` calls from ``concurrency`` workers, each with its own connection
+
+        ``request`` returns whether the response was valid; exceptions and
+        invalid responses count as errors and are left out of the latencies.
+        """
+        latencies: List[float] = []
+        errors = 0
+
+        async def phase(indices: range, measured: bool):
+            counter = iter(indices)
+
+            async def worker():
+                nonlocal errors
+                connection = await connect()
+                try:
+                    for index in counter:
+                        started = time.perf_counter()
+                        try:
+                            ok = await asyncio.wait_for(request(connection, index), timeout=self.timeout)
+                        except Exception as e:
+                            print(f"   {name} request {index} failed: {type(e).__name__}: {e}", file=sys.stderr)
+                            ok = False
+                        elapsed = time.perf_counter() - started
+                        if not measured:
+                            continue
+                        if ok:
+                            latencies.append(elapsed)
+                        else:
+                            errors += 1
+                finally:
+                    await close(connection)
+
+            await asyncio.gather(*[worker() for _ in range(self.concurrency)])
+
+        await phase(range(self.warmup), measured=False)
+        started = time.perf_counter()
+        await phase(range(self.warmup, self.warmup + self.requests), measured=True)
+        return summarize(latencies, errors, time.perf_counter() - started)
+
+    async def http_client(self) -> httpx.AsyncClient:
+        return httpx.AsyncClient(base_url=self.base_url, timeout=self.timeout)
+
+    @staticmethod
+    async def close_http(client: httpx.AsyncClient):
+        await client.aclose()
+
+    async def execute(self, client: httpx.AsyncClient, index: int) -> bool:
+        response = await client.post("/execute", json={
+            "code": self.code(EXECUTE_CODE, index),
+            "timeout": 10,
+            "cache": not self.unique
+        })
+        return response.status_code == 200 and response.json().get("status") == "success"
+
+    async def explain(self, client: httpx.AsyncClient, index: int) -> bool:
+        response = await client.post("/explain", json={
+            "code": self.code(EXPLAIN_CODE, index),
+            "detail_level": "medium"
+        })
+        # The error fallback has no generation_time
+        return response.status_code == 200 and "generation_time" in response.json()
+
+    async def ws_connect(self):
+        return await websockets.connect(f"{self.ws_url}/ws/code-suggestions", max_size=None)
+
+    @staticmethod
+    async def ws_close(connection):
+        await connection.close()
+
+    async def suggest(self, connection, index: int) -> bool:
+        seq = index + 1
+        await connection.send(json.dumps({
+            "type": "code_update",
+            "content": self.code(SUGGESTION_CODE, index),
+            "seq": seq
+        }))
+        while True:
+            message = json.loads(await connection.recv())
+            if message.get("type") == "suggestions" and message.get("seq") == seq:
+                return isinstance(message.get("content"), list)
+            if message.get("type") == "error" and message.get("seq") == seq:
+                return False
+
+    async def run(self, scenarios: List[str]) -> Dict[str, Any]:
+        runners = {
+            "execute": (self.http_client, self.execute, self.close_http),
+            "explain": (self.http_client, self.explain, self.close_http),
+            "suggestions": (self.ws_connect, self.suggest, self.ws_close)
+        }
+        results = {}
+        for name in scenarios:
+            print(f"🔍 Running {name} ({self.requests} requests, concurrency {self.concurrency})...", file=sys.stderr)
+            connect, request, close = runners[name]
+            results[name] = await self.run_scenario(name, connect, request, close)
+        return results
+
+async def server_info(base_url: str) -> Dict[str, Any]:
+    """Model and executor configuration reported by the server, recorded with the results"""
+    info = {}
+    async with httpx.AsyncClient(base_url=base_url, timeout=10) as client:
+        for key, path in (("model", "/ready"), ("executor", "/api/execute/stats")):
+            try:
+                info[key] = (await client.get(path)).json()
+            except Exception as e:
+                info[key] = {"error": str(e)}
+    return info
+
+def wait_until_ready(base_url: str, timeout: float):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f"{base_url}/ready", timeout=2).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f"Server at {base_url} was not ready within {timeout} seconds")
+
+def spawn_server(port: int) -> subprocess.Popen:
+    """Start the backend with the stub model and in-process caches"""
+    backend_dir = Path(__file__).resolve().parent / "backend"
+    env = dict(os.environ, LLM_BACKEND="stub", REDIS_URL="", PYTHONPATH=str(backend_dir))
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=backend_dir,
+        env=env
+    )
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def print_summary(results: Dict[str, Any]):
+    print(f"\n📊 {'scenario':<12} {'ok/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7}", file=sys.stderr)
+    for name, stats in results.items():
+        latency = stats["latency_ms"]
+        print(
+            f"   {name:<12} {stats['throughput']:>8.1f} {latency['p50']:>9.1f} {latency['p95']:>9.1f} "
+            f"{latency['p99']:>9.1f} {stats['errors']:>7}",
+            file=sys.stderr
+        )
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="Comma-separated subset of: " + ", ".join(SCENARIOS))
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent connections per scenario")
+    parser.add_argument("--requests", type=int, default=100, help="Measured requests per scenario")
+    parser.add_argument("--warmup", type=int, default=5, help="Requests per scenario excluded from the latencies")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Per-request timeout in seconds")
+    parser.add_argument("--cached", action="store_true", help="Repeat identical requests so results come from the caches")
+    parser.add_argument("--spawn", action="store_true", help="Start a local server with the stub model")
+    parser.add_argument("--port", type=int, default=8765, help="Port for --spawn")
+    parser.add_argument("--output", help="Write JSON results here instead of stdout")
+    args = parser.parse_args()
+
+    scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+
+    server = None
+    base_url = args.base_url
+    if args.spawn:
+        base_url = f"http://127.0.0.1:{args.port}"
+        server = spawn_server(args.port)
+    try:
+        wait_until_ready(base_url, timeout=300)
+        benchmark = Benchmark(base_url, args.concurrency, args.requests, args.warmup, args.timeout, not args.cached)
+        results = asyncio.run(benchmark.run(scenarios))
+        info = asyncio.run(server_info(base_url))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=30)
+
+    report = {
+        "metadata": {
+            "timestamp": time.time(),
+            "git_commit": git_commit(),
+            "python": platform.python_version(),
+            "host": platform.node(),
+            "base_url": base_url,
+            "spawned_stub_server": args.spawn,
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "warmup": args.warmup,
+            "cached": args.cached,
+            "server": info
+        },
+        "scenarios": results
+    }
+    print_summary(results)
+    output = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(output + "\n")
+        print(f"\n✅ Results written to {args.output}", file=sys.stderr)
+    else:
+        print(output)
+    return 1 if any(stats["errors"] for stats in results.values()) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
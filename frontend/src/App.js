@@ -1,11 +1,11 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useMemo, useRef } from 'react';
 import { ThemeProvider, createTheme } from '@mui/material/styles';
 import CssBaseline from '@mui/material/CssBaseline';
 import Box from '@mui/material/Box';
 import CodeEditor from './components/CodeEditor';
 import SuggestionPanel from './components/SuggestionPanel';
 import ExecutionPanel from './components/ExecutionPanel';
-import { connectWebSocket } from './services/websocket';
+import { connectWebSocket, sendMessage, debounce } from './services/websocket';
 
 const darkTheme = createTheme({
   palette: {
@@ -28,10 +28,27 @@ function App() {
   const [suggestions, setSuggestions] = useState([]);
   const [executionResult, setExecutionResult] = useState(null);
   const [ws, setWs] = useState(null);
+  // Sequence number of the latest code update; older responses are stale
+  const updateSeq = useRef(0);
 
   useEffect(() => {
     // Initialize WebSocket connection
     const socket = connectWebSocket();
+    socket.onmessage = (event) => {
+      const message = JSON.parse(event.data);
+      // Answer heartbeats so the server does not close this editor session as idle
+      if (message.type === 'ping') {
+        sendMessage(socket, { type: 'pong' });
+        return;
+      }
+      if (message.type !== 'suggestions' || message.seq < updateSeq.current) {
+        return;
+      }
+      setSuggestions(prev => [
+        ...prev.filter(suggestion => suggestion.type === 'explanation'),
+        ...message.content.map(content => ({ type: 'suggestion', content }))
+      ]);
+    };
     setWs(socket);
 
     return () => {
@@ -41,16 +58,21 @@ function App() {
     };
   }, []);
 
+  // Only send once typing pauses; the server also drops superseded updates
+  const debouncedSend = useMemo(() => debounce((socket, message) => {
+    sendMessage(socket, message);
+  }, 300), []);
+
   const handleCodeChange = async (newCode) => {
     setCode(newCode);
     
     // Send code to WebSocket for real-time suggestions
-    if (ws && ws.readyState === WebSocket.OPEN) {
-      ws.send(JSON.stringify({
-        type: 'code_update',
-        content: newCode
-      }));
-    }
+    updateSeq.current += 1;
+    debouncedSend(ws, {
+      type: 'code_update',
+      seq: updateSeq.current,
+      content: newCode
+    });
   };
 
   const handleCodeExecution = async () => {